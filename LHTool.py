@@ -119,10 +119,12 @@ def loadLHPiece(buf, inData, unk):
     return copiedAmount.value
     
 
-def decompressLH(inData):
+def decompressLHReference(inData):
     """
     Decompresses LH data. Argument should be a
     bytes or bytearray object.
+    This is a direct translation of the original C++ code, and is
+    kept as a reference for decompressLH.
     """
     # Make a LHContext
     context = LHContext()
@@ -276,6 +278,202 @@ def decompressLH(inData):
 
     return bytes(outBuf)
 
+def loadLHTable(inData, offset, bits):
+    """
+    Reads one of the two Huffman trees from the LH header, starting at
+    offset. Returns the tree entries as a list of ints (entry 0 is
+    unused) and the number of bytes the table takes up.
+    Same logic as loadLHPiece, without the ctypes wrappers.
+    """
+    maxEntries = 2 << bits
+    mask = (1 << bits) - 1
+
+    if bits <= 8:
+        dataSize = (inData[offset] + 1) << 2
+        copiedAmount = 1
+    else:
+        dataSize = ((inData[offset] | (inData[offset + 1] << 8)) + 1) << 2
+        copiedAmount = 2
+    pos = offset + copiedAmount
+
+    entries = [0] * maxEntries
+    count = 1
+    bitBuf = 0
+    bitCount = 0
+    while copiedAmount < dataSize:
+        if bitCount < bits:
+            needed = (bits + 7 - bitCount) >> 3
+            for i in range(needed):
+                bitBuf = ((bitBuf << 8) | inData[pos]) & 0xFFFFFFFF
+                pos += 1
+            copiedAmount += needed
+            bitCount += needed << 3
+
+        if count < maxEntries:
+            entries[count] = (bitBuf >> (bitCount - bits)) & mask
+            count += 1
+
+        bitCount -= bits
+
+    return entries, copiedAmount
+
+
+def buildLHLookup(entries, offsetMask, leafFlag, lookupBits):
+    """
+    Builds a lookup table that decodes up to lookupBits bits of a
+    Huffman tree at once. Each item is packed as
+    (value << 5) | (bits used << 1) | isLeaf, where value is the
+    decoded symbol for leaves, or the tree node to continue from
+    for codes longer than lookupBits.
+    """
+    table = []
+    for prefix in range(1 << lookupBits):
+        node = 1
+        for i in range(lookupBits):
+            bit = (prefix >> (lookupBits - 1 - i)) & 1
+            entry = entries[node]
+            child = (node & ~1) + (((entry & offsetMask) + 1) << 1) + bit
+            if entry & (leafFlag >> bit):
+                table.append((entries[child] << 5) | ((i + 1) << 1) | 1)
+                break
+            node = child
+        else:
+            table.append((node << 5) | (lookupBits << 1))
+    return table
+
+
+def decompressLH(inData):
+    """
+    Decompresses LH data. Argument should be a bytes-like object.
+    Table-driven version of decompressLHReference: Huffman codes are
+    decoded several bits at a time through lookup tables, and the input
+    is read through a memoryview instead of being re-sliced.
+    """
+    src = memoryview(inData)
+    srcLen = len(src)
+
+    outSize = src[1] | (src[2] << 8) | (src[3] << 16)
+    pos = 4
+    if outSize == 0:
+        outSize = src[4] | (src[5] << 8) | (src[6] << 16) | (src[7] << 24)
+        pos = 8
+    outBuf = bytearray(outSize)
+
+    # Load the trees: literals/lengths (9-bit entries) and
+    # distance bit counts (5-bit entries)
+    symEntries, size = loadLHTable(src, pos, 9)
+    pos += size
+    distEntries, size = loadLHTable(src, pos, 5)
+    pos += size
+
+    SYM_BITS, DIST_BITS = 10, 7
+    symTable = buildLHLookup(symEntries, 0x7F, 0x100, SYM_BITS)
+    distTable = buildLHLookup(distEntries, 7, 0x10, DIST_BITS)
+    symMask = (1 << SYM_BITS) - 1
+    distMask = (1 << DIST_BITS) - 1
+
+    bitBuf = 0
+    bitCount = 0
+    outIndex = 0
+
+    while outIndex < outSize:
+
+        # Decode a literal/length symbol
+        while bitCount <= 24 and pos < srcLen:
+            bitBuf = ((bitBuf << 8) | src[pos]) & 0xFFFFFFFF
+            pos += 1
+            bitCount += 8
+        if bitCount >= SYM_BITS:
+            item = symTable[(bitBuf >> (bitCount - SYM_BITS)) & symMask]
+        else:
+            item = symTable[(bitBuf << (SYM_BITS - bitCount)) & symMask]
+        bitCount -= (item >> 1) & 0xF
+
+        if item & 1:
+            sym = item >> 5
+        else:
+            # Long code: walk the rest of the tree a bit at a time
+            node = item >> 5
+            while True:
+                if not bitCount:
+                    bitBuf = src[pos]
+                    pos += 1
+                    bitCount = 8
+                bitCount -= 1
+                bit = (bitBuf >> bitCount) & 1
+                entry = symEntries[node]
+                child = (node & ~1) + (((entry & 0x7F) + 1) << 1) + bit
+                if entry & (0x100 >> bit):
+                    sym = symEntries[child]
+                    break
+                node = child
+
+        if sym < 0x100:
+            outBuf[outIndex] = sym
+            outIndex += 1
+            continue
+
+        # Block copy: decode the distance bit count
+        length = (sym & 0xFF) + 3
+
+        while bitCount <= 24 and pos < srcLen:
+            bitBuf = ((bitBuf << 8) | src[pos]) & 0xFFFFFFFF
+            pos += 1
+            bitCount += 8
+        if bitCount >= DIST_BITS:
+            item = distTable[(bitBuf >> (bitCount - DIST_BITS)) & distMask]
+        else:
+            item = distTable[(bitBuf << (DIST_BITS - bitCount)) & distMask]
+        bitCount -= (item >> 1) & 0xF
+
+        if item & 1:
+            distBits = item >> 5
+        else:
+            node = item >> 5
+            while True:
+                if not bitCount:
+                    bitBuf = src[pos]
+                    pos += 1
+                    bitCount = 8
+                bitCount -= 1
+                bit = (bitBuf >> bitCount) & 1
+                entry = distEntries[node]
+                child = (node & ~1) + (((entry & 7) + 1) << 1) + bit
+                if entry & (0x10 >> bit):
+                    distBits = distEntries[child]
+                    break
+                node = child
+
+        # Read the distance itself: an implicit 1 bit followed
+        # by distBits - 1 explicit bits
+        dist = 0
+        if distBits:
+            distBits -= 1
+            while bitCount < distBits:
+                bitBuf = ((bitBuf << 8) | src[pos]) & 0xFFFFFFFF
+                pos += 1
+                bitCount += 8
+            bitCount -= distBits
+            dist = ((1 << distBits) | ((bitBuf >> bitCount) & ((1 << distBits) - 1))) & 0xFFFF
+        dist = (dist + 1) & 0xFFFF
+
+        if length > outSize - outIndex:
+            length = outSize - outIndex
+        start = outIndex - dist
+        if start < 0:
+            raise ValueError('Invalid LH back-reference')
+
+        if dist >= length:
+            outBuf[outIndex:outIndex + length] = outBuf[start:start + length]
+        elif dist:
+            # Overlapping copy: the last dist bytes repeat
+            outBuf[outIndex:outIndex + length] = (outBuf[start:outIndex] * (length // dist + 1))[:length]
+        # (A distance of 0 copies each byte onto itself, leaving zeroes)
+        outIndex += length
+
+    return bytes(outBuf)
+
+
 def isLHCompressed(data):
     """
     Returns True if it appears that the data is LH-compressed.
@@ -285,7 +483,36 @@ def isLHCompressed(data):
     # it appears that every LH file begins with an @.
     # Since U8 archives begin with U\xAA8-, they will
     # never trigger this.
-    return data.startswith(b'@')
+    return data[:1] == b'@'
+
+def verify(fileNames):
+    """
+    Conformance test: decompresses each file with both decompressLH and
+    decompressLHReference, and checks that the results are identical
+    """
+    import time
+
+    allOk = True
+    for fileName in fileNames:
+        with open(fileName, 'rb') as inFile:
+            inData = inFile.read()
+
+        start = time.perf_counter()
+        expected = decompressLHReference(inData)
+        refTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = decompressLH(inData)
+        newTime = time.perf_counter() - start
+
+        ok = result == expected
+        allOk = allOk and ok
+        print('{0}: {1} ({2} bytes, reference {3:.3f}s, table-driven {4:.3f}s)'.format(
+            fileName, 'OK' if ok else 'MISMATCH', len(expected), refTime, newTime))
+
+    if not allOk:
+        raise ValueError('decompressLH does not match the reference implementation!')
+
 
 def main():
     """
@@ -305,6 +532,10 @@ def main():
     selfName = argv[0]
     argv = argv[1:]
 
+    if len(argv) >= 2 and argv[0] == '-v':
+        verify(argv[1:])
+        return
+
     argsAreCorrect = ('-d' in argv) or ('-c' in argv)
     if ('-d' in argv) and ('-c' in argv):
         argsAreCorrect = False
@@ -315,7 +546,8 @@ def main():
         errorTxt = '' \
             'Command-line arguments are missing or wrong. Usage:\n' \
             'To decompress a file: ' + selfName + ' -d compFile.bin decompFile.bin\n' \
-            'To compress a file: ' + selfName + ' -c decompFile.bin compFile.bin\n'
+            'To compress a file: ' + selfName + ' -c decompFile.bin compFile.bin\n' \
+            'To check the decompressor against the reference one: ' + selfName + ' -v compFile.bin [compFile2.bin ...]\n'
         raise ValueError(errorTxt)
 
     if '-d' in argv:
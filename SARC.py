@@ -33,16 +33,28 @@
 # Imports
 
 import struct
+import time
 
 
 class File():
     """
-    Class that represents a file of unknown format
+    Class that represents a file of unknown format.
+    If the archive was loaded lazily, data is a read-only memoryview
+    into the archive's buffer rather than a copy.
     """
     def __init__(self, name='', data=b''):
         self.name = name
         self.data = data
 
+    def materialize(self):
+        """
+        Replaces memoryview-backed data with a copy of its own, so that
+        the file no longer refers to the archive's buffer. Returns it.
+        """
+        if isinstance(self.data, memoryview):
+            self.data = self.data.tobytes()
+        return self.data
+
 
 
 class Folder():
@@ -56,30 +68,46 @@ class Folder():
         else:
             self.contents = set()
 
+        # The archive whose path index this folder is part of, and
+        # this folder's path within it
+        self._archive = None
+        self._path = ''
+
     def addFile(self, file):
         self.contents.add(file)
+        if self._archive is not None:
+            self._archive._indexAdd(self._path + '/' + file.name, file)
 
     def removeFile(self, file):
-        self.contents.add(file)
+        self.contents.discard(file)
+        if self._archive is not None:
+            self._archive._indexRemove(self._path + '/' + file.name, file)
 
     def addFolder(self, folder):
-        self.contents.add(folder)
+        self.addFile(folder)
 
     def removeFolder(self, folder):
-        self.contents.add(folder)
+        self.removeFile(folder)
 
 
 
 class FileArchive():
     """
-    Class that represents any Nintendo file archive
+    Class that represents any Nintendo file archive.
+    Besides the folder tree in self.contents, a flat index of every
+    file and folder by its full path is kept, so that lookups by
+    path don't have to walk the tree.
     """
     def __init__(self):
         self.contents = set()
+        self._index = {}
         self.endian = '>'
 
     def clear(self):
         self.contents = set()
+        for obj in self._index.values():
+            if isinstance(obj, Folder): obj._archive = None
+        self._index = {}
 
     def __str__(self):
         """
@@ -110,30 +138,54 @@ class FileArchive():
         addFolderStructure(self.contents, 0)
         return s[1:] # Remove the leading \n
 
-    def __getitem__(self, key):
+    @staticmethod
+    def _normalizePath(key):
         """
-        Returns the file requested when one indexes this archive
+        Returns key as an index path: forward slashes, no leading or
+        trailing slash
         """
-        currentPlaceToLook = self.contents
-        folderStructure = key.replace('\\', '/').split('/')
-
-        for folderName in folderStructure[:-1]:
-            found = False
-
-            for lookObj in currentPlaceToLook:
-                if isinstance(lookObj, Folder) and lookObj.name == folderName:
-                    currentPlaceToLook = lookObj.contents
-                    found = True
-                    break
+        return key.replace('\\', '/').strip('/')
 
-            if not found:
-                raise KeyError('File/Folder not found')
+    def _indexAdd(self, path, obj):
+        """
+        Adds obj (and, if it's a folder, everything in it) to the index
+        """
+        self._index[path] = obj
+        if isinstance(obj, Folder):
+            obj._archive = self
+            obj._path = path
+            for child in obj.contents:
+                self._indexAdd(path + '/' + child.name, child)
+
+    def _indexRemove(self, path, obj):
+        """
+        Removes obj (and, if it's a folder, everything in it) from the index
+        """
+        if self._index.get(path) is obj:
+            del self._index[path]
+        if isinstance(obj, Folder):
+            obj._archive = None
+            for child in obj.contents:
+                self._indexRemove(path + '/' + child.name, child)
 
-        for file in currentPlaceToLook:
-            if file.name == folderStructure[-1]: return file
+    def __contains__(self, key):
+        return self._normalizePath(key) in self._index
 
-        raise KeyError('File/Folder not found')
+    def __iter__(self):
+        """
+        Iterates over (path, file) pairs for every file in the archive
+        """
+        for path, obj in self._index.items():
+            if isinstance(obj, File): yield path, obj
 
+    def __getitem__(self, key):
+        """
+        Returns the file requested when one indexes this archive
+        """
+        try:
+            return self._index[self._normalizePath(key)]
+        except KeyError:
+            raise KeyError('File/Folder not found')
 
     def __setitem__(self, key, val):
         """
@@ -142,64 +194,51 @@ class FileArchive():
         if not isinstance(val, (Folder, File)):
             raise TypeError('New value is not a file or folder!')
 
-        currentPlaceToLook = self.contents
-        folderStructure = key.replace('\\', '/').split('/')
-
-        File.name = folderStructure[-1]
-
-        for folderName in folderStructure[1:]:
-            found = False
-            for lookObj in currentPlaceToLook:
-                if isinstance(lookObj, Folder) and lookObj.name == folderName:
-                    currentPlaceToLook = lookObj.contents
-                    found = True
-                    break
-            if not found:
-                newFolder = Folder(folderName)
-                currentPlaceToLook.add(newFolder)
-                currentPlaceToLook = newFolder.contents
-
-        for file in currentPlaceToLook:
-            if file.name == key: currentPlaceToLook.remove(file)
-        currentPlaceToLook.add(val)
-
+        path = self._normalizePath(key)
+        folderStructure = path.split('/')
+        val.name = folderStructure[-1]
 
+        # Find or make the folders leading up to it
+        outerFolder = self
+        folderPath = ''
+        for folderName in folderStructure[:-1]:
+            folderPath = folderPath + '/' + folderName if folderPath else folderName
+            folder = self._index.get(folderPath)
+            if not isinstance(folder, Folder):
+                if folder is not None: outerFolder.removeFile(folder)
+                folder = Folder(folderName)
+                outerFolder.addFolder(folder)
+            outerFolder = folder
+
+        old = self._index.get(path)
+        if old is not None: outerFolder.removeFile(old)
+        outerFolder.addFile(val)
 
     def __delitem__(self, key):
         """
         Handles the request to delete an index of the archive
         """
-        currentPlaceToLook = self.contents
-        folderStructure = key.replace('\\', '/').split('/')
-
-        for folderName in folderStructure[1:]:
-            found = False
-            for lookObj in currentPlaceToLook:
-                if isinstance(lookObj, Folder) and lookObj.name == folderName:
-                    currentPlaceToLook = lookObj.contents
-                    found = True
-                    break
-            if not found:
-                raise KeyError('File/Folder not found')
+        path = self._normalizePath(key)
+        obj = self[path]
 
-        for file in currentPlaceToLook:
-            if file.name == key:
-                currentPlaceToLook.remove(file)
-                return
-
-        raise KeyError('File/Folder not found')
+        if '/' in path:
+            self._index[path.rsplit('/', 1)[0]].removeFile(obj)
+        else:
+            self.removeFile(obj)
 
     def addFile(self, file):
         self.contents.add(file)
+        self._indexAdd(file.name, file)
 
     def removeFile(self, file):
-        self.contents.add(file)
+        self.contents.discard(file)
+        self._indexRemove(file.name, file)
 
     def addFolder(self, folder):
-        self.contents.add(folder)
+        self.addFile(folder)
 
     def removeFolder(self, folder):
-        self.contents.add(folder)
+        self.removeFile(folder)
 
 
 
@@ -207,7 +246,7 @@ class SARC_Archive(FileArchive):
     """
     Class that represents a Wii U SARC Archive
     """
-    def __init__(self, data=None):
+    def __init__(self, data=None, lazy=False):
         super().__init__()
 
         self.endianness = '>'
@@ -218,24 +257,41 @@ class SARC_Archive(FileArchive):
 
         self.hashMultiplier = 0x65
 
+        # The buffer this archive was loaded from, and where each file
+        # was in it, for incremental saving. Only kept for lazy loads,
+        # where the file data refers to that buffer anyway.
+        self._source = None
+        self._sourceEntries = {}
+
+        # Incremental saves fall back to a full save once more than
+        # this fraction of the archive would be dead space
+        self.maxDeadSpace = 0.25
+
         if data is not None:
-            self.load(data)
+            self.load(data, lazy)
 
-    def load(self, data):
+    def load(self, data, lazy=False):
         """
-        Loads a SARC file from data
+        Loads a SARC file from data (any bytes-like object, or an mmap).
+        If lazy is True, file data is not copied out of the archive:
+        each File.data is a memoryview into data, so data must not be
+        modified while the archive is in use. Only lazily loaded
+        archives can be saved incrementally.
         """
 
-        result = self._load(data)
+        result = self._load(data, lazy)
         if result is not True:
             raise ValueError('This is not a valid SARC file! Error code: ' + str(result))
 
-    def _load(self, data):
+    def _load(self, data, lazy=False):
+
+        if lazy:
+            data = memoryview(data).cast('B')
 
         # SARC Header -----------------------------------------
 
         # File magic (0x00 - 0x03)
-        if not data.startswith(b'SARC'): return 1
+        if data[:4] != b'SARC': return 1
 
         # Come back to header length later, when we have endianness
 
@@ -280,51 +336,19 @@ class SARC_Archive(FileArchive):
 
 
         # SFAT Nodes (0x20 - 0x20+(0x10*nodeCount))
-        SFATNodes = []
-
+        # Each one is a name hash, a flag byte and name offset / 4 (the
+        # flag is in the top byte in either endianness), and the file
+        # data start and end. They're all decoded in one go.
         SFATNodeOffset = 0x20
-        for nodeNum in range(nodeCount):
-
-            # SFAT Node ID: we don't really use this for anything.
-            nodeID = struct.unpack(endian + 'I', data[SFATNodeOffset:SFATNodeOffset + 4])[0]
-
-            if endian == '>':
-                unkFlagOffset = SFATNodeOffset + 4
-                fileNameTableEntryOffsetOffset = SFATNodeOffset + 5
-            else:
-                unkFlagOffset = SFATNodeOffset + 7
-                fileNameTableEntryOffsetOffset = SFATNodeOffset + 4
-
-            # Unknown flag: Could function as a file/folder flag.
-            unkFlag = data[unkFlagOffset]
-
-            # File Name Table Entry offset
-            if endian == '>':
-                fileNameTableEntryOffsetData = b'\x00' + data[fileNameTableEntryOffsetOffset:fileNameTableEntryOffsetOffset + 3]
-            else:
-                fileNameTableEntryOffsetData = data[fileNameTableEntryOffsetOffset:fileNameTableEntryOffsetOffset + 3] + b'\x00'
-            fileNameTableEntryOffset = struct.unpack(endian + 'I', fileNameTableEntryOffsetData)[0]
-
-            # Beginning of Node File Data
-            fileDataStart = struct.unpack(endian + 'I', data[SFATNodeOffset + 8:SFATNodeOffset + 0x0C])[0]
-
-            # End of Node File Data
-            fileDataEnd = struct.unpack(endian + 'I', data[SFATNodeOffset + 0x0C:SFATNodeOffset + 0x10])[0]
-
-            # Calculate file data length
-            fileDataLength = fileDataEnd - fileDataStart
-
-            # Add an entry to the node list
-            SFATNodes.append((unkFlag, fileNameTableEntryOffset, fileDataStart, fileDataLength))
-
-            # Increment the offset counter
-            SFATNodeOffset += 0x10
+        SFATNodesEnd = SFATNodeOffset + (0x10 * nodeCount)
+        if len(data) < SFATNodesEnd: return 7
+        SFATNodes = struct.iter_unpack(endian + '4I', data[SFATNodeOffset:SFATNodesEnd])
 
 
         # SFNT Header -----------------------------------------
 
         # From now on we need to keep track of an offset variable
-        offset = 0x20 + (0x10 * nodeCount)
+        offset = SFATNodesEnd
 
         # Sanity check (offset - offset+0x03)
         if data[offset:offset + 0x04] != b'SFNT': return 7
@@ -334,67 +358,53 @@ class SARC_Archive(FileArchive):
         if headLen != 0x08: return 8
 
         # Unknown value (offset+0x06 - offset+0x07)
-        unkVal = struct.unpack(endian + 'H', data[offset + 0x06:offset + 0x08])[0]
         # This is always 0x0000, but let's not check for that
         # because we ultimately don't know what this is.
 
         # Increment the offset
         offset += 0x08
 
+        # The file names table runs from here to the file data. Names
+        # are null-terminated, so find() is used to get their ends.
+        fileNamesTable = bytes(data[offset:begOfDat])
+
 
         # Add the files to the self.contents set --------------
         self.clear()
-        for unkFlag, fileNameTableEntryOffset, fileDataStart, fileDataLength in SFATNodes:
-
-            # Get the file name (search for the first null byte manually)
-            nameOffset = offset + (fileNameTableEntryOffset * 4)
-            nameLen = 0
-            while True:
-                if data[nameOffset + nameLen] > 0:
-                    nameLen += 1
-                else:
-                    break
-            name = data[nameOffset:nameOffset + nameLen].decode('utf-8')
-
-            # Get the file data
-            fileData = data[begOfDat + fileDataStart:begOfDat + fileDataStart + fileDataLength]
-
-            # Split it into its folders
+        self._source = memoryview(data).cast('B') if lazy else None
+        self._sourceEntries = {}
+        for nodeNum, (nodeHash, fileNameInfo, fileDataStart, fileDataEnd) in enumerate(SFATNodes):
+
+            # Get the file name
+            nameOffset = (fileNameInfo & 0xFFFFFF) * 4
+            nameEnd = fileNamesTable.find(b'\0', nameOffset)
+            if nameEnd == -1: return 9
+            name = fileNamesTable[nameOffset:nameEnd].decode('utf-8')
+
+            # Get the file data (a memoryview, if loading lazily)
+            fileData = data[begOfDat + fileDataStart:begOfDat + fileDataEnd]
+
+            # Find the folder it goes in, making any missing folders
+            # along the way. Folders already made are found through
+            # the path index, so this doesn't need to search.
             folderStructure = name.split('/')
-
-            # Handle it differently if the file is not in a folder
-            if len(folderStructure) == 1:
-                self.contents.add(File(name, fileData))
-            else:
-                # Get the first folder, or make one if needed
-                folderName = folderStructure[0]
-                foundFolder = None
-                for checkFolder in self.contents:
-                    if not isinstance(checkFolder, Folder): continue
-                    if checkFolder.name == folderName:
-                        foundFolder = checkFolder
-                        break
-                if foundFolder is None:
-                    foundFolder = Folder(folderName)
-                    self.contents.add(foundFolder)
-
-                # Now find/make the rest of them
-                outerFolder = foundFolder
-                for folderName in folderStructure[1:-1]:
-                    foundFolder = None
-                    for checkFolder in outerFolder.contents:
-                        if not isinstance(checkFolder, Folder): continue
-                        if checkFolder.name == folderName:
-                            foundFolder = checkFolder
-                            break
-                    if foundFolder is None:
-                        foundFolder = Folder(folderName)
-                        outerFolder.addFolder(folder)
-
-                    outerFolder = foundFolder
-
-                # Now make a new file and add it to self.contents
-                outerFolder.addFile(File(folderStructure[-1], fileData))
+            outerFolder = self
+            folderPath = ''
+            for folderName in folderStructure[:-1]:
+                folderPath = folderPath + '/' + folderName if folderPath else folderName
+                folder = self._index.get(folderPath)
+                if folder is None:
+                    folder = Folder(folderName)
+                    outerFolder.addFolder(folder)
+                outerFolder = folder
+
+            # Now make a new file and add it to its folder
+            file = File(folderStructure[-1], fileData)
+            outerFolder.addFile(file)
+
+            # Remember where it came from
+            if lazy:
+                self._sourceEntries[name] = (nodeNum, begOfDat + fileDataStart, fileData)
 
         # We're done! Return True so no exception will be thrown.
         return True
@@ -404,178 +414,301 @@ class SARC_Archive(FileArchive):
         """
         Returns the hash that should be used by an SFAT node.
         """
+        return struct.pack(endian + 'I', SARC_Archive._nameHash(filename, multiplier))
+
+    @staticmethod
+    def _nameHash(filename, multiplier):
+        """
+        Returns the SFAT hash of a filename as an int
+        """
         result = 0
         for char in filename:
             result = result * multiplier + ord(char)
             result &= 0xFFFFFFFF
 
-        return struct.pack(endian + 'I', result)
+        return result
 
-    def save(self, padding=4, dataStartOffset=None):
+    @staticmethod
+    def peek(data, path):
         """
-        Returns a bytes object that can be saved to a file.
-
-        This function works but is a total mess that needs to be cleaned up sometime.
+        Returns a memoryview of the data of one file in a SARC, without
+        loading the rest of the archive. data can be any bytes-like
+        object or an mmap. The SFAT nodes are sorted by name hash, so
+        the node is found by binary search and then the name is checked
+        against the SFNT table. Raises KeyError if the file isn't there.
         """
-        endian = self.endianness
-        if dataStartOffset == None: dataStartOffset = padding
-
-
-
-        # Flatten the file list
-        flatList = []
-
-        def addToFlatList(folder, path):
-            nonlocal flatList
-
-            for checkObj in folder.contents:
-                if isinstance(checkObj, File):
-                    flatList.append((path + '/' + checkObj.name, checkObj))
-                else:
-                    addToFlatList(checkObj, path + checkObj.name)
-
-        for checkObj in self.contents:
-            if isinstance(checkObj, File):
-                flatList.append((checkObj.name, checkObj))
+        data = memoryview(data).cast('B')
+        if data[:4] != b'SARC' or data[0x14:0x18] != b'SFAT':
+            raise ValueError('This is not a valid SARC file!')
+
+        endian = '>' if data[0x06:0x08] == b'\xFE\xFF' else '<'
+        begOfDat = struct.unpack_from(endian + 'I', data, 0x0C)[0]
+        nodeCount, multiplier = struct.unpack_from(endian + 'HI', data, 0x1A)
+        namesOffset = 0x20 + (0x10 * nodeCount) + 0x08
+
+        path = path.replace('\\', '/').strip('/')
+        hash = SARC_Archive._nameHash(path, multiplier)
+        name = path.encode('utf-8')
+
+        # Find the first node with this hash
+        lo, hi = 0, nodeCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from(endian + 'I', data, 0x20 + (0x10 * mid))[0] < hash:
+                lo = mid + 1
             else:
-                addToFlatList(checkObj, checkObj.name)
-
-
-        # Sort the files
-        flatList.sort(
-            key=lambda filetuple:
-                struct.unpack(
-                    self.endianness + 'I',
-                    self.filenameHash(filetuple[0], self.endianness, self.hashMultiplier),
-                    ),
-            )
-
-        # Put each file object into a list
-        files = [[file,] for file in flatList]
-
-        # Create the File Names table
-        fileNamesTable = b''
-        for i, filetuplelist in enumerate(files):
-
-            filepath = filetuplelist[0][0]
-            files[i] = [filetuplelist[0][1],]
-            file = files[i]
-
-            # Add the name offset, this will be used later
-            file.append(len(fileNamesTable))
-
-            # Add the name to the table
-            fileNamesTable += filepath.encode('utf-8')
-
-            # Pad to 0x04
-            fileNamesTable += b'\x00' * (0x04 - (len(fileNamesTable) % 0x04))
-
-        # Determine the length of the SFAT Nodes table
-        SFATNodesTableLen = 0x10 * len(files)
-
-        # Determine the Beginning Of Data offset
-        begOfDat = max(0x20 + SFATNodesTableLen + 0x08 + len(fileNamesTable), dataStartOffset)
-
-        # Create the File Data table
-        fileDataTable = b''
-        for file in files:
-
-            # Pad it to 0x04, relative to file start (if we're not at the very start)
-            totalFileLen = len(fileDataTable) + begOfDat
-            if totalFileLen % padding != 0:
-                fileDataTable += b'\x00' * (padding - (totalFileLen % padding))
-            assert (begOfDat + len(fileDataTable)) % padding == 0
-
-            # Add the data offset, this will be used later
-            file.append(len(fileDataTable))
-
-            # Add the data to the table
-            fileDataTable += file[0].data
-
-        # Calculate total file length
-        totalFileLen = begOfDat + len(fileDataTable)
-
+                hi = mid
 
-        # SARC Header -----------------------------------------
-
-        # File magic
-        sarcHead = b'SARC'
-
-        # Header length (always 0x14)
-        sarcHead += struct.pack(endian + 'H', 0x14)
-
-        # BOM
-        sarcHead += b'\xFE\xFF' if self.endianness == '>' else b'\xFF\xFE'
+        # Hashes can collide, so check the names of all nodes with it
+        for nodeNum in range(lo, nodeCount):
+            nodeHash, nameInfo, fileDataStart, fileDataEnd = struct.unpack_from(
+                endian + '4I', data, 0x20 + (0x10 * nodeNum))
+            if nodeHash != hash: break
 
-        # File Length
-        sarcHead += struct.pack(endian + 'I', totalFileLen)
+            # The top byte is a flag that's set if the node has a name
+            # in the SFNT table; the rest is the name's offset / 4
+            if nameInfo >> 24:
+                nameOffset = namesOffset + ((nameInfo & 0xFFFFFF) * 4)
+                end = nameOffset + len(name)
+                if data[nameOffset:end] != name or data[end] != 0: continue
 
-        # Beginning Of Data offset
-        sarcHead += struct.pack(endian + 'I', begOfDat)
+            return data[begOfDat + fileDataStart:begOfDat + fileDataEnd]
 
-        # Unknown value 0x10000000
-        if self.endianness == '>':
-            sarcHead += b'\x01\x00\x00\x00'
-        else:
-            sarcHead += b'\x00\x01\x00\x00'
+        raise KeyError('File/Folder not found')
 
-        # SFAT Header -----------------------------------------
+    def _layout(self, padding, dataStartOffset):
+        """
+        Works out where everything goes in a saved archive. Returns a
+        list of (path, file, hash, nameOffset, dataOffset) tuples in
+        SFAT order, the length of the file names table, the Beginning
+        Of Data offset and the total archive length.
+        """
+        if dataStartOffset is None: dataStartOffset = padding
 
-        # File magic
-        sfatHead = b'SFAT'
+        # SFAT nodes are sorted by hash
+        entries = sorted(
+            ((self._nameHash(path, self.hashMultiplier), path, file) for path, file in self),
+            key=lambda entry: entry[0],
+            )
 
-        # Header length (always 0x0C)
-        sfatHead += struct.pack(endian + 'H', 0x0C)
+        # File names: each one is null-terminated and padded to 0x04
+        # (a name that's already a multiple of 4 long gets 4 nulls)
+        nameOffsets = []
+        namesLen = 0
+        for hash, path, file in entries:
+            nameOffsets.append(namesLen)
+            namesLen += (len(path.encode('utf-8')) & ~3) + 4
 
-        # Number of files
-        sfatHead += struct.pack(endian + 'H', len(files))
+        begOfDat = max(0x20 + (0x10 * len(entries)) + 0x08 + namesLen, dataStartOffset)
 
-        # Hash multiplier
-        sfatHead += struct.pack(endian + 'I', self.hashMultiplier)
+        # File data: each file is aligned to padding, relative to the
+        # start of the archive
+        layout = []
+        dataEnd = begOfDat
+        for (hash, path, file), nameOffset in zip(entries, nameOffsets):
+            dataEnd += -dataEnd % padding
+            layout.append((path, file, hash, nameOffset, dataEnd - begOfDat))
+            dataEnd += len(file.data)
 
-        # SFAT Nodes
-        sfat = b''
-        for file_filenameoffset_filedataoffset, filepath_file in zip(files, flatList):
-            file, filenameoffset, filedataoffset = file_filenameoffset_filedataoffset
-            #filedataoffset -= begOfDat
-            print(hex(filedataoffset))
-            filepath, file = filepath_file
-            # File ID
-            sfat += self.filenameHash(filepath, self.endianness, self.hashMultiplier)
-            # Filename Offset (4 bytes + a constant?)
-            sfat += struct.pack(endian + 'I', (filenameoffset // 4) | 0x1000000)
-            # Filedata Offset
-            sfat += struct.pack(endian + 'I', filedataoffset)
-            # Filedata Length + Filedata Offset
-            sfat += struct.pack(endian + 'I', filedataoffset + len(file.data))
+        return layout, namesLen, begOfDat, dataEnd
 
+    def _chunks(self, padding, dataStartOffset):
+        """
+        Generates the saved archive as a series of bytes-like chunks.
+        File data is yielded as-is, without being copied.
+        """
+        layout, namesLen, begOfDat, totalFileLen = self._layout(padding, dataStartOffset)
+        endian = self.endianness
+        nodeCount = len(layout)
+
+        # Everything up to the file names table goes in one buffer
+        sfntOffset = 0x20 + (0x10 * nodeCount)
+        header = bytearray(sfntOffset + 0x08)
+
+        # SARC header: magic, header length, BOM, file length,
+        # Beginning Of Data offset, unknown value 0x0100
+        header[0x00:0x04] = b'SARC'
+        struct.pack_into(endian + 'HHIIHH', header, 0x04,
+            0x14, 0xFEFF, totalFileLen, begOfDat, 0x100, 0)
+
+        # SFAT header: magic, header length, node count, hash multiplier
+        header[0x14:0x18] = b'SFAT'
+        struct.pack_into(endian + 'HHI', header, 0x18, 0x0C, nodeCount, self.hashMultiplier)
+
+        # SFAT nodes: hash, name flag | name offset / 4, data start, data end
+        nodeStruct = struct.Struct(endian + '4I')
+        for i, (path, file, hash, nameOffset, dataOffset) in enumerate(layout):
+            nodeStruct.pack_into(header, 0x20 + (0x10 * i),
+                hash, 0x1000000 | (nameOffset // 4), dataOffset, dataOffset + len(file.data))
+
+        # SFNT header: magic, header length, padding
+        header[sfntOffset:sfntOffset + 0x04] = b'SFNT'
+        struct.pack_into(endian + 'H', header, sfntOffset + 0x04, 0x08)
+
+        # File names table
+        names = bytearray(namesLen)
+        for path, file, hash, nameOffset, dataOffset in layout:
+            name = path.encode('utf-8')
+            names[nameOffset:nameOffset + len(name)] = name
+
+        yield header
+        yield names
+
+        # File data, and the padding before each file
+        offset = len(header) + namesLen
+        for path, file, hash, nameOffset, dataOffset in layout:
+            dataOffset += begOfDat
+            if dataOffset > offset: yield bytes(dataOffset - offset)
+            yield file.data
+            offset = dataOffset + len(file.data)
+
+        # With no files, the padding up to begOfDat is all that's left
+        if totalFileLen > offset: yield bytes(totalFileLen - offset)
+
+    def _patchChunks(self, padding):
+        """
+        Generates the archive as a patch of the buffer it was loaded
+        from, or returns None if that isn't possible because files were
+        added, removed or renamed, or there's no such buffer. None is
+        also returned if the patch would leave too much dead space
+        (see maxDeadSpace), so that the archive gets compacted.
+
+        Unchanged files, and the headers, are yielded as views into the
+        original buffer. A changed file is written over its old data
+        if it fits there; if not, its old data is zeroed and it's moved
+        to the end of the archive, aligned to padding.
+        """
+        source = self._source
+        if source is None: return None
+        if source[0x06:0x08] != (b'\xFE\xFF' if self.endianness == '>' else b'\xFF\xFE'): return None
+        if struct.unpack_from(self.endianness + 'I', source, 0x1C)[0] != self.hashMultiplier: return None
 
-        # SFNT Header -----------------------------------------
+        files = dict(self)
+        if files.keys() != self._sourceEntries.keys(): return None
 
-        # File magic
-        sfntHead = b'SFNT'
+        endian = self.endianness
+        sourceLen = len(source)
+        begOfDat = struct.unpack_from(endian + 'I', source, 0x0C)[0]
+
+        # Go through the files in the order their data is in, so that
+        # each one's space runs up to the start of the next
+        order = sorted(self._sourceEntries.items(), key=lambda item: item[1][1])
+        changed = []
+        dead = growth = 0
+        for i, (path, (nodeNum, start, oldData)) in enumerate(order):
+            data = files[path].data
+            if data is oldData: continue
+            if len(data) == len(oldData) and data == oldData: continue
+            space = (order[i + 1][1][1] if i + 1 < len(order) else sourceLen) - start
+            changed.append((start, space, nodeNum, data))
+
+            # A file that doesn't fit leaves all of its old space empty
+            if len(data) <= space:
+                dead += max(len(oldData) - len(data), 0)
+            else:
+                dead += len(oldData)
+                growth += len(data) + padding
+
+        if dead > (sourceLen + growth) * self.maxDeadSpace: return None
+
+        # Patch the header and the SFAT nodes of changed files
+        header = bytearray(source[:begOfDat])
+        chunks = [header]
+        offset = begOfDat
+        end = sourceLen
+        moved = []
+        for start, space, nodeNum, data in changed:
+            chunks.append(source[offset:start])
+            if len(data) <= space:
+                dataStart = start
+                chunks.append(data)
+                if len(data) < space: chunks.append(bytes(space - len(data)))
+            else:
+                end += -end % padding
+                dataStart = end
+                end += len(data)
+                chunks.append(bytes(space))
+                moved.append((dataStart, data))
+            offset = start + space
+
+            struct.pack_into(endian + 'II', header, 0x20 + (0x10 * nodeNum) + 0x08,
+                dataStart - begOfDat, dataStart - begOfDat + len(data))
+        chunks.append(source[offset:sourceLen])
+
+        # Files that didn't fit go at the end
+        offset = sourceLen
+        for dataStart, data in moved:
+            if dataStart > offset: chunks.append(bytes(dataStart - offset))
+            chunks.append(data)
+            offset = dataStart + len(data)
+
+        struct.pack_into(endian + 'I', header, 0x08, end)
+        return chunks
+
+    def save(self, padding=4, dataStartOffset=None, incremental=False):
+        """
+        Returns a bytes object that can be saved to a file. If
+        incremental is True and the archive was loaded from a buffer
+        with the same set of files, that buffer is patched instead of
+        laying out the whole archive again.
+        """
+        return b''.join(self._saveChunks(padding, dataStartOffset, incremental))
 
-        # Header length (always 0x08)
-        if self.endianness == '>':
-            sfntHead += b'\x00\x08'
+    def saveTo(self, out, padding=4, dataStartOffset=None, incremental=False):
+        """
+        Writes the archive to out, which can be a bytearray (which is
+        appended to) or a writable file object. The file data is written
+        straight from each file, without building the archive in memory.
+        """
+        chunks = self._saveChunks(padding, dataStartOffset, incremental)
+        if isinstance(out, bytearray):
+            for chunk in chunks:
+                out += chunk
         else:
-            sfntHead += b'\x08\x00'
-
-        # 2-byte padding
-        sfntHead += b'\x00\x00'
-
+            out.writelines(chunks)
 
-        # File Data Table Padding
-        headerSize = len(sarcHead + sfatHead + sfat + sfntHead + fileNamesTable)
-        fileDataTablePadding = b''
-        if begOfDat > headerSize:
-            fileDataTablePadding = b'\0' * (begOfDat - headerSize)
+    def _saveChunks(self, padding, dataStartOffset, incremental):
+        chunks = None
+        if incremental:
+            chunks = self._patchChunks(padding)
+        if chunks is None:
+            chunks = self._chunks(padding, dataStartOffset)
 
+            # The saved archive no longer matches the old buffer's
+            # layout, so there's no point holding on to it
+            self._source = None
+            self._sourceEntries = {}
+        return chunks
 
-        # Put It All Together ---------------------------------
 
-        fileData = sarcHead + sfatHead + sfat + sfntHead + fileNamesTable + fileDataTablePadding + fileDataTable
-
-        # Return the data
-        return fileData
 
+def benchmark(counts=(1000, 5000, 20000), repeat=5):
+    """
+    Times loading synthetic archives with the given numbers of files,
+    which are spread across 16 folders and 64 bytes long each
+    """
+    for count in counts:
+        arc = SARC_Archive()
+        for i in range(count):
+            arc['folder%d/file%d.bin' % (i % 16, i)] = File(data=bytes(64))
+        data = arc.save()
+
+        def best(func):
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        eager = best(lambda: SARC_Archive(data))
+        lazy = best(lambda: SARC_Archive(data, lazy=True))
+        save = best(lambda: arc.save())
+        peek = best(lambda: SARC_Archive.peek(data, 'folder0/file0.bin'))
+
+        print('%6d files (%d KB): load %.1f ms, lazy load %.1f ms, save %.1f ms, peek %.3f ms' % (
+            count, len(data) // 1024, eager * 1000, lazy * 1000, save * 1000, peek * 1000))
+
+
+if __name__ == '__main__':
+    benchmark()
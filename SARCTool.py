@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Reggie! - New Super Mario Bros. U Level Editor
+# Version Next Milestone 2 Alpha 4
+# Copyright (C) 2009-2015 Treeki, Tempus, angelsl, JasonP27, Kamek64,
+# MalStar1000, RoadrunnerWMC, MrRean
+
+# This file is part of Reggie!.
+
+# Reggie! is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Reggie! is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Reggie!.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# SARCTool.py
+# Command-line tool for listing, extracting, verifying and repacking
+# SARC/SZS archives in bulk, such as a whole Stage or Unit folder.
+# Archives are processed in parallel, one per worker process.
+
+
+################################################################
+################################################################
+
+# Imports
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+import compression
+import SARC as SarcLib
+import yaz0
+
+
+# Archives are recognized by these extensions when a folder is given
+ArchiveExtensions = ('.szs', '.sarc')
+
+# Name of the file in the output folder that records the content hashes
+# of what was last processed (for --only-changed), and the format of
+# each extracted archive (so that repack can match it)
+ManifestName = 'sarctool-hashes.json'
+
+# Largest file data alignment that's guessed for an extracted archive
+MaxAlignment = 0x2000
+
+
+def findArchives(paths):
+    """
+    Returns the archive files in paths, looking through folders recursively
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(ArchiveExtensions):
+                        found.append(os.path.join(root, name))
+        else:
+            found.append(path)
+    return found
+
+
+def findFolders(paths):
+    """
+    Returns the folders in paths that contain extracted archives. A
+    folder given directly is one archive unless it only has subfolders,
+    in which case each subfolder is one.
+    """
+    found = []
+    for path in paths:
+        entries = sorted(entry for entry in os.listdir(path) if entry != ManifestName)
+        if entries and all(os.path.isdir(os.path.join(path, entry)) for entry in entries):
+            found.extend(os.path.join(path, entry) for entry in entries)
+        else:
+            found.append(path)
+    return found
+
+
+def readArchive(filename):
+    """
+    Reads an archive file, decompressing it if needed. Returns the raw
+    file data, the name of the codec (or None) and the SARC data.
+    """
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    codec = compression.sniff(raw)
+    data = compression.decompress(raw)
+    return raw, None if codec is None else codec.name, data
+
+
+def archivePathParts(path):
+    """
+    Splits the path of a file in an archive into its folder and file
+    names. Raises ValueError for paths that could end up outside the
+    folder the archive is extracted to.
+    """
+    parts = path.replace('\\', '/').split('/')
+    for part in parts:
+        if part in ('', '.', '..') or os.path.isabs(part) or os.path.splitdrive(part)[0]:
+            raise ValueError('Unsafe file path in archive: %r' % path)
+    return parts
+
+
+def archiveFormat(data):
+    """
+    Returns what's needed to repack a SARC the way it was: endianness,
+    hash multiplier, start of the file data, and file data alignment
+    (guessed from where the files are, up to MaxAlignment)
+    """
+    endian = '>' if data[0x06:0x08] == b'\xFE\xFF' else '<'
+    begOfDat = struct.unpack_from(endian + 'I', data, 0x0C)[0]
+    nodeCount, multiplier = struct.unpack_from(endian + 'HI', data, 0x1A)
+
+    alignment = MaxAlignment
+    for nodeNum in range(nodeCount):
+        dataStart = begOfDat + struct.unpack_from(endian + 'I', data, 0x28 + (0x10 * nodeNum))[0]
+        if dataStart: alignment = min(alignment, dataStart & -dataStart)
+
+    return {
+        'endianness': endian,
+        'hashMultiplier': multiplier,
+        'dataStartOffset': begOfDat,
+        'padding': alignment,
+        }
+
+
+def folderFiles(folder):
+    """
+    Returns (path within the archive, filename) pairs for every file in
+    an extracted archive folder, sorted by path
+    """
+    files = []
+    for root, dirs, names in os.walk(folder):
+        for name in names:
+            filename = os.path.join(root, name)
+            path = os.path.relpath(filename, folder).replace(os.sep, '/')
+            files.append((path, filename))
+    files.sort()
+    return files
+
+
+def contentHash(filename):
+    """
+    Returns the content hash of an archive file or an extracted archive
+    folder (which covers its file paths and contents)
+    """
+    h = hashlib.sha1()
+    if os.path.isdir(filename):
+        for path, name in folderFiles(filename):
+            h.update(path.encode('utf-8') + b'\0')
+            with open(name, 'rb') as f:
+                h.update(f.read())
+    else:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def archiveName(filename):
+    """
+    Returns the name of an archive file without its extension
+    """
+    name = os.path.basename(os.path.normpath(filename))
+    if name.lower().endswith(ArchiveExtensions):
+        name = os.path.splitext(name)[0]
+    return name
+
+
+################################################################
+# Jobs. Each one runs in a worker process and returns
+# (filename, bytes in, bytes out, seconds, message, archive format),
+# where the archive format is None except for extract.
+
+def listJob(filename):
+    start = time.perf_counter()
+    raw, codec, data = readArchive(filename)
+    arc = SarcLib.SARC_Archive(data, lazy=True)
+
+    lines = ['%s (%s, %d files)' % (filename, codec or 'uncompressed', len(list(arc)))]
+    for path, file in sorted(arc):
+        lines.append('  %8d  %s' % (len(file.data), path))
+
+    return filename, len(raw), len(data), time.perf_counter() - start, '\n'.join(lines), None
+
+
+def extractJob(filename, outDir):
+    start = time.perf_counter()
+    raw, codec, data = readArchive(filename)
+    arc = SarcLib.SARC_Archive(data, lazy=True)
+
+    # Check every path before writing anything
+    base = os.path.join(outDir, archiveName(filename))
+    files = [(os.path.join(base, *archivePathParts(path)), file) for path, file in arc]
+
+    for outName, file in files:
+        os.makedirs(os.path.dirname(outName), exist_ok=True)
+        with open(outName, 'wb') as f:
+            f.write(file.data)
+
+    return (filename, len(raw), len(data), time.perf_counter() - start,
+        '%d files -> %s' % (len(files), base), archiveFormat(data))
+
+
+def verifyJob(filename):
+    start = time.perf_counter()
+    raw, codec, data = readArchive(filename)
+    arc = SarcLib.SARC_Archive(data, lazy=True)
+
+    # Every file has to be findable by its name hash, which checks that
+    # the node table is sorted and that the hashes match the names
+    problems = []
+    for path, file in arc:
+        try:
+            found = SarcLib.SARC_Archive.peek(data, path)
+        except KeyError:
+            problems.append(path)
+            continue
+        if found != file.data: problems.append(path)
+
+    if problems:
+        message = 'FAILED: ' + ', '.join(sorted(problems))
+    else:
+        message = 'OK'
+    return filename, len(raw), len(data), time.perf_counter() - start, message, None
+
+
+def repackJob(folder, outDir, padding, compressLevel):
+    start = time.perf_counter()
+
+    # Use the format the archive had when it was extracted, if the
+    # manifest next to the folder knows it
+    folder = os.path.normpath(folder)
+    manifest = loadManifest(os.path.dirname(os.path.abspath(folder)))
+    sarcFormat = manifest['formats'].get(archiveName(folder), {})
+
+    arc = SarcLib.SARC_Archive()
+    arc.endianness = sarcFormat.get('endianness', arc.endianness)
+    arc.hashMultiplier = sarcFormat.get('hashMultiplier', arc.hashMultiplier)
+    if padding is None: padding = sarcFormat.get('padding', 0x2000)
+    bytesIn = 0
+    for path, name in folderFiles(folder):
+        with open(name, 'rb') as f:
+            data = f.read()
+        arc[path] = SarcLib.File(data=data)
+        bytesIn += len(data)
+
+    data = arc.save(padding, sarcFormat.get('dataStartOffset'))
+    if compressLevel is None:
+        outName = os.path.join(outDir, archiveName(folder) + '.sarc')
+    else:
+        outName = os.path.join(outDir, archiveName(folder) + '.szs')
+        data = yaz0.compress(data, compressLevel)
+
+    with open(outName, 'wb') as f:
+        f.write(data)
+
+    return folder, bytesIn, len(data), time.perf_counter() - start, '-> ' + outName, None
+
+
+################################################################
+
+def runJobs(job, filenames, extraArgs, processes, manifest=None):
+    """
+    Runs job for each of filenames in a process pool, and prints
+    per-file timings and throughput as they finish. If manifest (a
+    dict of filename -> content hash) is given, files whose hash hasn't
+    changed are skipped, and the manifest is updated. Returns the
+    number of failures, and a dict of archive name -> archive format
+    for the jobs that returned one.
+    """
+    formats = {}
+    if manifest is not None:
+        hashes = {filename: contentHash(filename) for filename in filenames}
+        skipped = [filename for filename in filenames if manifest.get(os.path.abspath(filename)) == hashes[filename]]
+        filenames = [filename for filename in filenames if filename not in skipped]
+        if skipped: print('Skipping %d unchanged' % len(skipped))
+
+    totalIn = totalOut = 0
+    failures = 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = {executor.submit(job, filename, *extraArgs): filename for filename in filenames}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                filename, bytesIn, bytesOut, seconds, message, sarcFormat = future.result()
+            except Exception as e:
+                print('%s: ERROR: %s' % (filename, e))
+                failures += 1
+                continue
+
+            if message.startswith('FAILED'): failures += 1
+            elif manifest is not None: manifest[os.path.abspath(filename)] = hashes[filename]
+            if sarcFormat is not None: formats[archiveName(filename)] = sarcFormat
+
+            totalIn += bytesIn
+            totalOut += bytesOut
+            print('%s: %s [%d KB -> %d KB, %.1f ms, %.1f MB/s]' % (
+                filename, message, bytesIn // 1024, bytesOut // 1024,
+                seconds * 1000, max(bytesIn, bytesOut) / max(seconds, 1e-9) / 0x100000))
+
+    elapsed = time.perf_counter() - start
+    print('%d archives, %d KB -> %d KB in %.2f s (%.1f MB/s), %d failed' % (
+        len(filenames), totalIn // 1024, totalOut // 1024, elapsed,
+        max(totalIn, totalOut) / max(elapsed, 1e-9) / 0x100000, failures))
+    return failures, formats
+
+
+def loadManifest(outDir):
+    """
+    Loads the manifest in outDir as a dict with 'hashes' (filename ->
+    content hash) and 'formats' (archive name -> archive format)
+    """
+    try:
+        with open(os.path.join(outDir, ManifestName), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+
+    # Older manifests only had the hashes
+    if 'hashes' not in manifest:
+        manifest = {'hashes': manifest}
+    manifest.setdefault('formats', {})
+    return manifest
+
+
+def saveManifest(outDir, manifest):
+    with open(os.path.join(outDir, ManifestName), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def main():
+    """
+    Main script function for command-line usage
+    """
+    parser = argparse.ArgumentParser(description='Lists, extracts, verifies and repacks SARC/SZS archives in bulk.')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    commands = parser.add_subparsers(dest='command')
+
+    listParser = commands.add_parser('list', help='list the files in archives')
+    listParser.add_argument('paths', nargs='+', help='archives, or folders to search for them')
+
+    verifyParser = commands.add_parser('verify', help='check that archives load and that every file can be found by its name hash')
+    verifyParser.add_argument('paths', nargs='+', help='archives, or folders to search for them')
+
+    extractParser = commands.add_parser('extract', help='extract archives into folders')
+    extractParser.add_argument('paths', nargs='+', help='archives, or folders to search for them')
+    extractParser.add_argument('-o', '--output', default='.', help='folder to extract to; each archive gets a subfolder')
+    extractParser.add_argument('--only-changed', action='store_true', help='skip archives that haven\'t changed since the last run')
+
+    repackParser = commands.add_parser('repack', help='pack extracted folders back into archives')
+    repackParser.add_argument('paths', nargs='+', help='extracted archive folders, or folders of them')
+    repackParser.add_argument('-o', '--output', default='.', help='folder to write the archives to')
+    repackParser.add_argument('--padding', type=lambda s: int(s, 0), default=None, help='file data alignment (default: what the archive had when extracted, or 0x2000 as for levels)')
+    repackParser.add_argument('--level', type=int, default=yaz0.DEFAULT_LEVEL, help='Yaz0 compression level, 0-9 (default: %d; 9 is smallest but much slower)' % yaz0.DEFAULT_LEVEL)
+    repackParser.add_argument('--no-compress', action='store_true', help='write uncompressed .sarc files')
+    repackParser.add_argument('--only-changed', action='store_true', help='skip folders that haven\'t changed since the last run')
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    if args.command == 'list':
+        failures, formats = runJobs(listJob, findArchives(args.paths), (), args.processes)
+    elif args.command == 'verify':
+        failures, formats = runJobs(verifyJob, findArchives(args.paths), (), args.processes)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        manifest = loadManifest(args.output)
+        hashes = manifest['hashes'] if args.only_changed else None
+
+        if args.command == 'extract':
+            failures, formats = runJobs(extractJob, findArchives(args.paths), (args.output,), args.processes, hashes)
+        else:
+            compressLevel = None if args.no_compress else args.level
+            failures, formats = runJobs(repackJob, findFolders(args.paths), (args.output, args.padding, compressLevel), args.processes, hashes)
+
+        # Extracting always records the archive formats, for repacking
+        manifest['formats'].update(formats)
+        if formats or hashes is not None: saveManifest(args.output, manifest)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__': sys.exit(main())
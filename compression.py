@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Reggie! - New Super Mario Bros. U Level Editor
+# Version Next Milestone 2 Alpha 4
+# Copyright (C) 2009-2015 Treeki, Tempus, angelsl, JasonP27, Kamek64,
+# MalStar1000, RoadrunnerWMC, MrRean
+
+# This file is part of Reggie!.
+
+# Reggie! is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Reggie! is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Reggie!.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# compression.py
+# A registry of the compression formats Reggie! can read (Yaz0, LH, LZ11).
+# Data is identified by its magic bytes and routed to the fastest decoder.
+
+
+################################################################
+################################################################
+
+# Imports
+
+import struct
+import time
+
+import LHTool
+import lz77
+import yaz0
+import yaz0_new
+
+
+class Codec():
+    """
+    Class that represents a compression format. Every codec has the
+    same buffer-in/buffer-out and streaming interface, and keeps
+    track of how much data it has processed.
+    """
+    def __init__(self, name, sniff, decompress, compress=None, streamDecoder=None, decompressPrefix=None):
+        self.name = name
+        self._sniff = sniff
+        self._decompress = decompress
+        self._compress = compress
+        self._streamDecoder = streamDecoder
+        self._decompressPrefix = decompressPrefix
+        self.resetCounters()
+
+    def __str__(self):
+        result = '{0}: {1} calls, {2} -> {3} bytes, {4:.1f} MB/s'.format(
+            self.name, self.calls, self.bytesIn, self.bytesOut, self.throughput())
+        if self.compressCalls:
+            result += '; compressed {0} calls, {1} -> {2} bytes, {3:.1f} MB/s'.format(
+                self.compressCalls, self.compressBytesIn, self.compressBytesOut, self.compressThroughput())
+        return result
+
+    def resetCounters(self):
+        """
+        Resets the throughput counters
+        """
+        self.calls = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.seconds = 0.0
+
+        self.compressCalls = 0
+        self.compressBytesIn = 0
+        self.compressBytesOut = 0
+        self.compressSeconds = 0.0
+
+    def throughput(self):
+        """
+        Returns the average decompressed MB per second so far
+        """
+        if not self.seconds: return 0.0
+        return self.bytesOut / self.seconds / 0x100000
+
+    def compressThroughput(self):
+        """
+        Returns the average MB of input compressed per second so far
+        """
+        if not self.compressSeconds: return 0.0
+        return self.compressBytesIn / self.compressSeconds / 0x100000
+
+    def sniff(self, data):
+        """
+        Returns True if the data appears to be in this format
+        """
+        return self._sniff(data)
+
+    def canCompress(self):
+        return self._compress is not None
+
+    def decompress(self, data):
+        """
+        Decompresses data and returns the result
+        """
+        start = time.perf_counter()
+        result = self._decompress(data)
+        self._count(len(data), len(result), time.perf_counter() - start)
+        return result
+
+    def decompressPrefix(self, data, size):
+        """
+        Decompresses only the first size bytes of data (fewer if the
+        decompressed data is shorter). Formats that can't stop early
+        are decompressed completely and cut down.
+        """
+        if self._decompressPrefix is None:
+            return self.decompress(data)[:size]
+
+        start = time.perf_counter()
+        result = self._decompressPrefix(data, size)
+        self._count(len(data), len(result), time.perf_counter() - start)
+        return result
+
+    def compress(self, data):
+        """
+        Compresses data and returns the result
+        """
+        if self._compress is None:
+            raise NotImplementedError(self.name + ' compression is not implemented!')
+
+        start = time.perf_counter()
+        result = self._compress(data)
+        self.compressCalls += 1
+        self.compressBytesIn += len(data)
+        self.compressBytesOut += len(result)
+        self.compressSeconds += time.perf_counter() - start
+        return result
+
+    def decoder(self):
+        """
+        Returns a new streaming decoder for this format
+        """
+        if self._streamDecoder is not None:
+            return StreamDecoder(self, self._streamDecoder())
+        return StreamDecoder(self, None)
+
+    def _count(self, bytesIn, bytesOut, seconds):
+        self.calls += 1
+        self.bytesIn += bytesIn
+        self.bytesOut += bytesOut
+        self.seconds += seconds
+
+
+
+class StreamDecoder():
+    """
+    Streaming decoder: feed() compressed chunks and get back whatever
+    decompressed data is available, then call flush() at the end of
+    the input. Formats without a native streaming decoder are
+    buffered and decoded as a whole by flush().
+    """
+    def __init__(self, codec, native):
+        self.codec = codec
+        self._native = native
+        self._buffer = bytearray()
+        self._bytesIn = 0
+        self._bytesOut = 0
+        self._seconds = 0.0
+
+    def feed(self, data):
+        self._bytesIn += len(data)
+        if self._native is None:
+            self._buffer += data
+            return b''
+
+        start = time.perf_counter()
+        result = self._native.feed(data)
+        self._seconds += time.perf_counter() - start
+        self._bytesOut += len(result)
+        return result
+
+    def flush(self):
+        if self._native is None:
+            start = time.perf_counter()
+            result = self.codec._decompress(bytes(self._buffer))
+            self._seconds += time.perf_counter() - start
+            self._bytesOut += len(result)
+            self._buffer = bytearray()
+        else:
+            if not self._native.eof:
+                raise ValueError(self.codec.name + ' data ended early')
+            result = b''
+
+        self.codec._count(self._bytesIn, self._bytesOut, self._seconds)
+        return result
+
+
+
+# The registry. Order matters: the first codec whose sniff() accepts
+# the data is used.
+Codecs = []
+
+def register(codec):
+    """
+    Adds a codec to the registry, replacing one with the same name
+    """
+    for i, other in enumerate(Codecs):
+        if other.name == codec.name:
+            Codecs[i] = codec
+            return
+    Codecs.append(codec)
+
+
+def getCodec(name):
+    """
+    Returns the codec with the given name
+    """
+    for codec in Codecs:
+        if codec.name == name: return codec
+    raise KeyError('Unknown codec: ' + name)
+
+
+def sniff(data):
+    """
+    Returns the codec the data is compressed with, or None
+    """
+    for codec in Codecs:
+        if codec.sniff(data): return codec
+    return None
+
+
+def decompress(data, nested=False):
+    """
+    Decompresses data and returns the result. Uncompressed data is
+    returned unchanged. Only the outer layer is removed unless nested
+    is True: decompressed data can happen to look like a compressed
+    format (LZ11 only has one magic byte), so it's not sniffed again
+    by default.
+    """
+    codec = sniff(data)
+    if codec is None: return data
+
+    data = codec.decompress(data)
+    while nested:
+        codec = sniff(data)
+        if codec is None: break
+        data = codec.decompress(data)
+    return data
+
+
+def decompressPrefix(data, size):
+    """
+    Returns the first size bytes of the decompressed data, decoding no
+    more than needed where the format allows it. Uncompressed data is
+    just cut down.
+    """
+    codec = sniff(data)
+    if codec is None: return bytes(data[:size])
+    return codec.decompressPrefix(data, size)
+
+
+def _sniffLZ11(data):
+    # LZ11 has a single magic byte, so also check that the size field
+    # is sane to avoid mistaking random data for it
+    if len(data) < 4 or data[0] != 0x11: return False
+    size = struct.unpack_from('<I', data)[0] >> 8
+    if size == 0:
+        if len(data) < 8: return False
+        size = struct.unpack_from('<I', data, 4)[0]
+    return 0 < size <= 0x200000 << 8
+
+
+register(Codec(
+    'Yaz0',
+    lambda data: data[:4] == b'Yaz0',
+    yaz0_new.decompress,
+    yaz0.compress,
+    yaz0_new.Yaz0StreamDecoder,
+    yaz0_new.decompress_prefix,
+    ))
+register(Codec(
+    'LH',
+    LHTool.isLHCompressed,
+    LHTool.decompressLH,
+    ))
+register(Codec(
+    'LZ11',
+    _sniffLZ11,
+    lz77.decompress11,
+    lz77.compress11,
+    ))
@@ -98,11 +98,34 @@
 ################################################################
 
 
+import array
+import collections
 import struct
+import sys
 import time
 
-from PyQt5 import QtCore, QtGui
-Qt = QtCore.Qt
+# Qt is only used at the edges, to wrap decoded pixels in QImages. The
+# decoder itself doesn't need it, so it can also run in worker processes
+# and command-line tools.
+try:
+    from PyQt5 import QtCore, QtGui
+    Qt = QtCore.Qt
+except ImportError:
+    QtCore = QtGui = Qt = None
+
+# NumPy is optional. If it's available, textures are deswizzled with
+# array operations; otherwise, pure-Python fallbacks are used.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Shared memory (Python 3.8+) is used to hand decoded images back from
+# worker processes without pickling them through a pipe.
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 
 class GtxFile():
@@ -111,7 +134,10 @@ class GtxFile():
     Based on Wii U GTX Extractor.
     """
     width, height, padWidth, padHeight, format, dataSize = 0, 0, 0, 0, 0, 0
+    numMips, tileMode, swizzle, pitch = 1, 4, 0, 0
+    mipOffsets = ()
     data = b''
+    mipData = b''
 
     def padSize(self):
         """
@@ -147,22 +173,21 @@ class BLKHeaderStruct(struct.Struct):
 
 class RawTexInfoStruct(struct.Struct):
     """
-    Struct for raw tex info.
+    Struct for raw tex info (a GX2Surface).
     Based on Wii U GTX Extractor.
     """
     def __init__(self, endianness):
         super().__init__(endianness + '39I')
     def loadFrom(self, data, idx):
+        values = self.unpack_from(data, idx)
         (self._0, self.width, self.height, self._C,
-        self._10, self.format_, self._18, self._1C,
-        self.sizeMaybe, self._24, self._28, self._2C,
-        self._30, self._34, self._38, self._3C,
-        self._40, self._44, self._48, self._4C,
-        self._50, self._54, self._58, self._5C,
-        self._60, self._64, self._68, self._6C,
-        self._70, self._74, self._78, self._7C,
+        self.numMips, self.format_, self._18, self._1C,
+        self.sizeMaybe, self._24, self.mipSize, self._2C,
+        self.tileMode, self.swizzle, self._38, self.pitch) = values[:16]
+        self.mipOffsets = values[16:29]
+        (self._74, self._78, self._7C,
         self._80, self._84, self._88, self._8C,
-        self._90, self._94, self._98) = self.unpack_from(data, idx)
+        self._90, self._94, self._98) = values[29:]
 
 
 def loadGTX(input, endianness='>'):
@@ -172,7 +197,10 @@ def loadGTX(input, endianness='>'):
     """
     idx = 0
     width, height, format = 0, 0, 0
+    dataSize = 0
     gtxData = b''
+    mipData = b''
+    rawTexInfo = None
 
     # Parse the Gfx2 Header
     headStruct = Gfx2HeaderStruct(endianness)
@@ -191,10 +219,11 @@ def loadGTX(input, endianness='>'):
             raise ValueError('Wrong BLK section magic!')
         idx += blkStruct.size
 
-        if blkStruct._10 == 0x0B:
+        if blkStruct._10 == 0x0B and rawTexInfo is None:
             # Parse raw texture info
             rawTexInfoStruct.loadFrom(input, idx)
             idx += rawTexInfoStruct.size
+            rawTexInfo = rawTexInfoStruct
 
             width = rawTexInfoStruct.width
             height = rawTexInfoStruct.height
@@ -206,6 +235,11 @@ def loadGTX(input, endianness='>'):
             gtxData = input[idx:idx + dataSize]
             idx += dataSize
 
+        elif blkStruct._10 == 0x0D and len(mipData) == 0:
+            # Grab mipmap data
+            mipData = input[idx:idx + blkStruct.sectionSize]
+            idx += blkStruct.sectionSize
+
         else:
             # Ignore.
             idx += blkStruct.sectionSize
@@ -217,164 +251,731 @@ def loadGTX(input, endianness='>'):
     file.format = format
     file.dataSize = dataSize
     file.data = gtxData
+    file.mipData = mipData
+    if rawTexInfo is not None:
+        file.numMips = max(rawTexInfo.numMips, 1)
+        file.tileMode = rawTexInfo.tileMode
+        file.swizzle = rawTexInfo.swizzle
+        file.pitch = rawTexInfo.pitch
+        file.mipOffsets = rawTexInfo.mipOffsets
     file.padSize()
     return file
 
 
-def renderGTX(gtxObj):
+################################################################
+# Deswizzling, for every format.
+# This follows the GX2 (R600 AddrLib) tiling rules for linear, 1D
+# tiled and 2D tiled (thin) surfaces, which cover the textures used
+# by the games. Addresses are computed either for NumPy arrays of
+# coordinates all at once, or for plain ints.
+
+class AddressMapCache():
     """
-    Renders a GTX object.
+    Least-recently-used cache of surface address maps, keyed by surface
+    layout. Textures (tilesets especially) only come in a handful of
+    layouts, so once the map for one is made, deswizzling a texture
+    with that layout is a single gather. The cache is bounded by the
+    total size of the maps in it.
     """
-    # Higher threadSleepSecs = slower tileset loading but more responsive Reggie
-    # Smaller threadSleepSecs = faster tileset loading but laggier Reggie
-    threadSleepSecs = 0.06
+    def __init__(self, budget=0x4000000):
+        self.budget = budget
+        self.maps = collections.OrderedDict() # key -> (addresses, element count needed)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
 
-    if gtxObj.format == 0x1A:
-        return renderRGBA8(gtxObj, threadSleepSecs)
-    elif gtxObj.format == 0x33:
-        return renderDXT5(gtxObj, threadSleepSecs)
+    def __len__(self):
+        return len(self.maps)
+
+    def __str__(self):
+        return 'Address maps: {0} ({1} KB), {2} hits, {3} misses'.format(
+            len(self.maps), self.size // 1024, self.hits, self.misses)
+
+    def get(self, key):
+        """
+        Returns (addresses, element count needed) for a key, or None
+        """
+        entry = self.maps.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.maps.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, addresses):
+        """
+        Adds an address map, evicting the least recently used ones if
+        needed. Returns its entry.
+        """
+        if not len(addresses):
+            count = 0
+        elif numpy is not None and isinstance(addresses, numpy.ndarray):
+            count = int(addresses.max()) + 1
+        else:
+            count = max(addresses) + 1
+        entry = (addresses, count)
+        if key in self.maps:
+            self.size -= self._sizeOf(self.maps.pop(key)[0])
+        self.maps[key] = entry
+        self.size += self._sizeOf(addresses)
+
+        # Always keep the newest one, even if it's over budget by itself
+        while self.size > self.budget and len(self.maps) > 1:
+            oldKey, (oldAddresses, oldCount) = self.maps.popitem(last=False)
+            self.size -= self._sizeOf(oldAddresses)
+        return entry
+
+    def clear(self):
+        self.maps.clear()
+        self.size = 0
+
+    @staticmethod
+    def _sizeOf(addresses):
+        return len(addresses) * addresses.itemsize
+
+
+# Address maps, cached by surface layout
+AddressMaps = AddressMapCache()
+
+
+def _pixelIndexWithinMicroTile(x, y, bpp):
+    """
+    Returns the index of element (x, y) within its 8x8 micro tile
+    """
+    if bpp == 8:
+        bits = (x & 1, (x >> 1) & 1, (x >> 2) & 1, (y >> 1) & 1, y & 1, (y >> 2) & 1)
+    elif bpp == 16:
+        bits = (x & 1, (x >> 1) & 1, (x >> 2) & 1, y & 1, (y >> 1) & 1, (y >> 2) & 1)
+    elif bpp == 64:
+        bits = (x & 1, y & 1, (x >> 1) & 1, (x >> 2) & 1, (y >> 1) & 1, (y >> 2) & 1)
+    elif bpp == 128:
+        bits = (y & 1, x & 1, (x >> 1) & 1, (x >> 2) & 1, (y >> 1) & 1, (y >> 2) & 1)
     else:
-        raise NotImplementedError('Unknown texture format: ' + hex(gtxObj.format))
+        bits = (x & 1, (x >> 1) & 1, y & 1, (x >> 2) & 1, (y >> 1) & 1, (y >> 2) & 1)
+
+    index = bits[0]
+    for i, bit in enumerate(bits[1:], 1):
+        index = index | (bit << i)
+    return index
 
 
-def renderRGBA8(gtx, threadSleepSecs):
+def _surfaceAddress(x, y, bpp, pitch, tileMode, swizzle):
     """
-    Renders a RGBA8 GTX image to a QImage.
-    Based on Wii U GTX Extractor.
+    Returns the byte address of element (x, y) in a surface
     """
-    # uint32_t pos, x, y;
-    # uint32_t *source, *output;
-    pos, x, y = 0, 0, 0
-    output = bytearray(gtx.padWidth * gtx.padHeight * 4)
-
-    previousIntervals = []
-    for powOfTwo_FracOfPixelsToLoad in range(6, -1, -1):
-        # range: (6, 5, 4, 3, 2, 1, 0)
-        # First time through = 2 ** 6 = 64 = load every 64th pixel in each dimension
-        # Second time through = 2 ** 5 = 32 = load every 32nd pixel in each dimension (skipping ones that have already been rendered)
-        # ...
-        # Final time through = 2 ** 0 = 1 = load all remaining pixels
-        interval = 2 ** powOfTwo_FracOfPixelsToLoad
-
-        for y in range(0, gtx.padHeight, interval):
-            # Don't rerender rendered pixels
-            yprev = any(((y % inter == 0) for inter in previousIntervals))
-
-            time.sleep(threadSleepSecs)
-
-            for x in range(0, gtx.padWidth, interval):
-                # Don't rerender rendered pixels
-                if yprev and any(((x % inter == 0) for inter in previousIntervals)): continue
-
-                pos = (y & ~15) * gtx.padWidth
-                pos ^= (x & 3)
-                pos ^= ((x >> 2) & 1) << 3
-                pos ^= ((x >> 3) & 1) << 6
-                pos ^= ((x >> 3) & 1) << 7
-                pos ^= (x & ~0xF) << 4
-                pos ^= (y & 1) << 2
-                pos ^= ((y >> 1) & 7) << 4
-                pos ^= (y & 0x10) << 4
-                pos ^= (y & 0x20) << 2
-                pos *= 4
-
-                toPos = (y * gtx.width + x) * 4
-                output[toPos:toPos + 4] = swapRB(gtx.data[pos:pos + 4])
-        previousIntervals.append(interval)
-
-        # This has to be in its own loop in order to benefit from previous iterations!
-        progressiveOutput = bytearray((gtx.padWidth // interval) * (gtx.padHeight // interval) * 4)
-        for y in range(0, gtx.padHeight // interval):
-            for x in range(0, gtx.padWidth // interval):
-                progressiveOutputPos = (y * (gtx.padWidth // interval) + x) * 4
-                outputPos = ((y * interval) * gtx.padWidth + (x * interval)) * 4
-                progressiveOutput[progressiveOutputPos:progressiveOutputPos + 4] = output[outputPos:outputPos + 4]
-
-        img = QtGui.QImage(progressiveOutput, gtx.padWidth // interval, gtx.padHeight // interval, QtGui.QImage.Format_ARGB32)
-        if interval > 1:
-            yield img.scaledToWidth(gtx.padWidth, Qt.SmoothTransformation).copy(0, 0, gtx.width, gtx.height)
-        else:
-            yield img.copy(0, 0, gtx.width, gtx.height)
+    if tileMode in (0, 1):
+        # Linear
+        return (y * pitch + x) * (bpp // 8)
+
+    elemOffset = (bpp * _pixelIndexWithinMicroTile(x, y, bpp)) >> 3
+
+    if tileMode in (2, 3):
+        # 1D tiled: micro tiles are simply laid out in rows
+        return ((x >> 3) + (y >> 3) * (pitch >> 3)) * (bpp * 8) + elemOffset
+
+    # 2D tiled: micro tiles are grouped into 32x16-element macro tiles,
+    # spread over two pipes and four banks
+    pipe = ((y >> 3) ^ (x >> 3)) & 1
+    bank = (((y >> 5) ^ (x >> 3)) & 1) | ((((y >> 4) ^ (x >> 4)) & 1) << 1)
+    pipeSwizzle = (swizzle >> 8) & 1
+    bankSwizzle = (swizzle >> 9) & 3
+    bankPipe = ((pipe + 2 * bank) ^ (pipeSwizzle + 2 * bankSwizzle)) & 7
+
+    macroTileOffset = ((x >> 5) + (pitch >> 5) * (y >> 4)) * (bpp * 64)
+    totalOffset = elemOffset + (macroTileOffset >> 3)
+    return (((bankPipe >> 1) << 9) | ((bankPipe & 1) << 8)
+        | (totalOffset & 0xFF) | ((totalOffset & ~0xFF) << 3))
 
 
-def swapRB(bgra):
+def surfaceAddressMap(width, height, bpp, pitch, tileMode, swizzle):
     """
-    Swaps R and B.
-    Based on Wii U GTX Extractor.
+    Returns, for each element (pixel, or 4x4 block for compressed
+    formats) of a width x height surface in row-major order, the index
+    of the element in the swizzled data it comes from. This is a 32-bit
+    NumPy array if NumPy is available, or an array.array otherwise.
+    """
+    return _addressMapEntry(width, height, bpp, pitch, tileMode, swizzle)[0]
+
+
+def _addressMapEntry(width, height, bpp, pitch, tileMode, swizzle):
+    """
+    Returns the cache entry for surfaceAddressMap(): the map and the
+    number of elements the swizzled data has to have
     """
-    return bytes((bgra[2], bgra[1], bgra[0], 255))#bgra[3]))
+    if tileMode not in (0, 1, 2, 3, 4):
+        raise NotImplementedError('Unsupported tile mode: ' + str(tileMode))
+    if tileMode in (0, 1): swizzle = 0
+    swizzle &= 0x700
+
+    key = (width, height, bpp, pitch, tileMode, swizzle)
+    entry = AddressMaps.get(key)
+    if entry is not None: return entry
+
+    # The addressing pattern repeats every few rows (64 for 2D tiling,
+    # 8 for 1D and 1 for linear), moving forward by the same amount
+    # each time. So only those rows have to be worked out in full.
+    period = 64 if tileMode == 4 else 8 if tileMode in (2, 3) else 1
+    period = min(period, height)
+    step = _surfaceAddress(0, period, bpp, pitch, tileMode, swizzle) - _surfaceAddress(0, 0, bpp, pitch, tileMode, swizzle)
+    bytesPerElement = bpp // 8
+
+    if numpy is not None:
+        xs = numpy.arange(width, dtype=numpy.int64)[None, :]
+        ys = numpy.arange(period, dtype=numpy.int64)[:, None]
+        firstRows = _surfaceAddress(xs, ys, bpp, pitch, tileMode, swizzle)
+
+        rows = numpy.arange(height, dtype=numpy.int64)
+        addresses = firstRows[rows % period] + ((rows // period) * step)[:, None]
+        addresses = (addresses // bytesPerElement).astype(numpy.uint32).ravel()
+    else:
+        firstRows = [[_surfaceAddress(x, y, bpp, pitch, tileMode, swizzle) // bytesPerElement
+            for x in range(width)] for y in range(period)]
+        step //= bytesPerElement
 
+        addresses = array.array('I')
+        for y in range(height):
+            offset = (y // period) * step
+            addresses.extend([address + offset for address in firstRows[y % period]])
+
+    return AddressMaps.put(key, addresses)
+
+
+def deswizzle(data, width, height, bpp, pitch, tileMode, swizzle):
+    """
+    Deswizzles a surface. Returns the elements in row-major order, as
+    bytes (or a NumPy array of shape (count, bytes per element)).
+    """
+    addresses, count = _addressMapEntry(width, height, bpp, pitch, tileMode, swizzle)
+    bytesPerElement = bpp // 8
+
+    needed = count * bytesPerElement
+    if len(data) < needed:
+        data = bytes(data) + bytes(needed - len(data))
+
+    if numpy is not None:
+        source = numpy.frombuffer(data, numpy.uint8, len(data) // bytesPerElement * bytesPerElement)
+        return source.reshape(-1, bytesPerElement).take(addresses, axis=0)
+
+    # Gather whole elements as machine words where possible (their byte
+    # order is kept as-is)
+    source = memoryview(data).cast('B')[:len(data) // bytesPerElement * bytesPerElement]
+    typecode = {2: 'H', 4: 'I', 8: 'Q'}.get(bytesPerElement)
+    if typecode is not None:
+        source = source.cast(typecode)
+        return array.array(typecode, map(source.__getitem__, addresses)).tobytes()
+    return b''.join([source[address * bytesPerElement:(address + 1) * bytesPerElement] for address in addresses])
+
+
+################################################################
+# Decoders. Each takes deswizzled elements in row-major order and the
+# surface size in elements, and returns the pixels in row-major order
+# as B, G, R, A bytes (QImage.Format_ARGB32).
 
-def renderDXT5(gtx, threadSleepSecs):
+def decodeRGBA8(elements, width, height):
     """
-    Renders a DXT5 GTX image to a QImage.
+    Decodes RGBA8 pixels. Alpha is set to 255.
     Based on Wii U GTX Extractor.
     """
-    idx, x, y = 0, 0, 0
-    outValue = 0
-    blobWidth = gtx.padWidth // 4
-    blobHeight = gtx.padHeight // 4
-    work = bytearray(gtx.padWidth * gtx.padHeight)
-
-    for y in range(blobHeight):
-        for x in range(blobWidth):
-            pos = ((y >> 4) * (blobWidth * 16)) & 0xFFFF
-            pos ^= (y & 1)
-            pos ^= (x & 7) << 1
-            pos ^= (x & 8) << 1
-            pos ^= (x & 8) << 2
-            pos ^= (x & 0x10) << 2
-            pos ^= (x & ~0x1F) << 4
-            pos ^= (y & 2) << 6
-            pos ^= (y & 4) << 6
-            pos ^= (y & 8) << 1
-            pos ^= (y & 0x10) << 2
-            pos ^= (y & 0x20)
-
-            toPos = (y * blobWidth + x) * 16
-            pos *= 16
-            work[toPos:toPos + 16] = gtx.data[pos:pos + 16]
-
-    output = bytearray(gtx.padWidth * gtx.padHeight * 4)
-
-    previousIntervals = []
-    for powOfTwo_FracOfPixelsToLoad in range(6, -1, -1):
-        # range: (6, 5, 4, 3, 2, 1, 0)
-        # First time through = 2 ** 6 = 64 = load every 64th pixel in each dimension
-        # Second time through = 2 ** 5 = 32 = load every 32nd pixel in each dimension (skipping ones that have already been rendered)
-        # ...
-        # Final time through = 2 ** 0 = 1 = load all remaining pixels
-        interval = 2 ** powOfTwo_FracOfPixelsToLoad
-
-        for y in range(0, gtx.padHeight, interval):
-            # Don't rerender rendered pixels
-            yprev = any(((y % inter == 0) for inter in previousIntervals))
-
-            time.sleep(threadSleepSecs)
-
-            for x in range(0, gtx.padWidth, interval):
-                # Don't rerender rendered pixels
-                if yprev and any(((x % inter == 0) for inter in previousIntervals)): continue
-
-                outValue = calculateRGBAFromDxt5AtPosition(gtx.padWidth, work, x, y)
-
-                outputPos = (y * gtx.padWidth + x) * 4
-                output[outputPos:outputPos + 4] = outValue
-        previousIntervals.append(interval)
-
-        # This has to be in its own loop in order to benefit from previous iterations!
-        progressiveOutput = bytearray((gtx.padWidth // interval) * (gtx.padHeight // interval) * 4)
-        for y in range(0, gtx.padHeight // interval):
-            for x in range(0, gtx.padWidth // interval):
-                progressiveOutputPos = (y * (gtx.padWidth // interval) + x) * 4
-                outputPos = ((y * interval) * gtx.padWidth + (x * interval)) * 4
-                progressiveOutput[progressiveOutputPos:progressiveOutputPos + 4] = output[outputPos:outputPos + 4]
-
-        img = QtGui.QImage(progressiveOutput, gtx.padWidth // interval, gtx.padHeight // interval, QtGui.QImage.Format_ARGB32)
-        if interval > 1:
-            yield img.scaledToWidth(gtx.padWidth, Qt.SmoothTransformation).copy(0, 0, gtx.width, gtx.height)
+    count = width * height
+
+    if numpy is not None:
+        output = numpy.empty((count, 4), numpy.uint8)
+        output[:, 2::-1] = elements[:, :3]
+        output[:, 3] = 255
+        return output.tobytes()
+
+    # Swap R and B with strided slice assignments
+    output = bytearray(count * 4)
+    output[0::4] = elements[2::4]
+    output[1::4] = elements[1::4]
+    output[2::4] = elements[0::4]
+    output[3::4] = b'\xFF' * count
+    return output
+
+
+# 4-, 5- and 6-bit color channel expansions, as done by libtxc_dxtn
+Expand4 = [c * 0x11 for c in range(0x10)]
+Expand5 = [c * 0xFF // 0x1F for c in range(0x20)]
+Expand6 = [c * 0xFF // 0x3F for c in range(0x40)]
+
+# 16-bit formats, as lists of (expansion table, shift) for B, G, R and
+# A. Red is in the lowest bits.
+PackedFormats = {
+    'RGB565': ((Expand5, 11), (Expand6, 5), (Expand5, 0), None),
+    'RGB5A1': ((Expand5, 10), (Expand5, 5), (Expand5, 0), ([0, 0xFF], 15)),
+    'RGBA4': ((Expand4, 8), (Expand4, 4), (Expand4, 0), (Expand4, 12)),
+    }
+
+# Lookup tables from 16-bit values to B, G, R, A bytes, made when needed
+PackedTables = {}
+
+
+def _decodePacked(elements, width, height, name):
+    channels = PackedFormats[name]
+
+    if numpy is not None:
+        values = elements.copy().view('<u2').ravel().astype(numpy.int32)
+        output = numpy.empty((len(values), 4), numpy.uint8)
+        for i, channel in enumerate(channels):
+            if channel is None:
+                output[:, i] = 255
+            else:
+                table, shift = channel
+                output[:, i] = numpy.array(table, numpy.uint8)[(values >> shift) & (len(table) - 1)]
+        return output.tobytes()
+
+    if name not in PackedTables:
+        table = []
+        for value in range(0x10000):
+            pixel = []
+            for channel in channels:
+                if channel is None:
+                    pixel.append(255)
+                else:
+                    expand, shift = channel
+                    pixel.append(expand[(value >> shift) & (len(expand) - 1)])
+            table.append(bytes(pixel))
+        PackedTables[name] = table
+
+    values = array.array('H', elements)
+    if sys.byteorder == 'big': values.byteswap()
+    return b''.join(map(PackedTables[name].__getitem__, values))
+
+
+def decodeRGB565(elements, width, height):
+    """
+    Decodes RGB565 pixels
+    """
+    return _decodePacked(elements, width, height, 'RGB565')
+
+
+def decodeRGB5A1(elements, width, height):
+    """
+    Decodes RGB5A1 pixels
+    """
+    return _decodePacked(elements, width, height, 'RGB5A1')
+
+
+def decodeRGBA4(elements, width, height):
+    """
+    Decodes RGBA4 pixels
+    """
+    return _decodePacked(elements, width, height, 'RGBA4')
+
+
+# Block-compressed formats. With NumPy, every block is decoded at once;
+# without it, each block's palettes are worked out once and then its 16
+# texels are looked up.
+
+def _colorPalettesNumPy(blocks, offset, fourColor):
+    """
+    Returns the (B, G, R, A) palettes of the BC1-style color parts of
+    blocks, as an array of shape (blocks, 4, 4)
+    """
+    expand5 = numpy.array(Expand5, numpy.int32)
+    expand6 = numpy.array(Expand6, numpy.int32)
+    palettes = numpy.empty((len(blocks), 4, 4), numpy.int32)
+    palettes[:, :, 3] = 255
+
+    colors = []
+    for i in range(2):
+        color = blocks[:, offset + i * 2].astype(numpy.int32) | (blocks[:, offset + i * 2 + 1].astype(numpy.int32) << 8)
+        palettes[:, i, 0] = expand5[color & 0x1F]
+        palettes[:, i, 1] = expand6[(color >> 5) & 0x3F]
+        palettes[:, i, 2] = expand5[color >> 11]
+        colors.append(color)
+
+    color0, color1 = palettes[:, 0, :3], palettes[:, 1, :3]
+    palettes[:, 2, :3] = (color0 * 2 + color1) // 3
+    palettes[:, 3, :3] = (color0 + color1 * 2) // 3
+
+    if not fourColor:
+        # Blocks with color0 <= color1 have three colors and transparent black
+        threeColor = colors[0] <= colors[1]
+        palettes[threeColor, 2, :3] = (color0[threeColor] + color1[threeColor]) // 2
+        palettes[threeColor, 3] = 0
+
+    return palettes
+
+
+def _colorsNumPy(blocks, offset, fourColor):
+    """
+    Returns the B, G, R, A texels of the color parts of blocks, as an
+    array of shape (blocks, 16, 4)
+    """
+    palettes = _colorPalettesNumPy(blocks, offset, fourColor)
+    bits = blocks[:, offset + 4:offset + 8].copy().view('<u4').astype(numpy.uint64)
+    codes = ((bits >> (numpy.arange(16, dtype=numpy.uint64) * numpy.uint64(2))[None, :]) & numpy.uint64(3)).astype(numpy.intp)
+    return palettes[numpy.arange(len(blocks))[:, None], codes]
+
+
+def _interpolatedNumPy(blocks, offset, signed=False):
+    """
+    Returns the texels of BC3-style interpolated alpha (or BC4/BC5
+    channel) parts of blocks, as an array of shape (blocks, 16)
+    """
+    endpoints = blocks[:, offset:offset + 2]
+    if signed:
+        endpoints = numpy.maximum(endpoints.view(numpy.int8).astype(numpy.int32), -127)
+    else:
+        endpoints = endpoints.astype(numpy.int32)
+    a0, a1 = endpoints[:, :1], endpoints[:, 1:]
+
+    code = numpy.arange(2, 8, dtype=numpy.int32)[None, :]
+    eightValue = (a0 * (8 - code) + a1 * (code - 1)) // 7
+    sixValue = (a0 * (6 - code) + a1 * (code - 1)) // 5
+    sixValue[:, 4] = -127 if signed else 0
+    sixValue[:, 5] = 127 if signed else 255
+    palettes = numpy.concatenate((a0, a1, numpy.where(a0 > a1, eightValue, sixValue)), axis=1)
+    if signed: palettes += 128
+
+    bits = numpy.zeros(len(blocks), numpy.uint64)
+    for i in range(6):
+        bits |= blocks[:, offset + 2 + i].astype(numpy.uint64) << numpy.uint64(8 * i)
+    codes = ((bits[:, None] >> (numpy.arange(16, dtype=numpy.uint64) * numpy.uint64(3))[None, :]) & numpy.uint64(7)).astype(numpy.intp)
+    return numpy.take_along_axis(palettes, codes, axis=1)
+
+
+def _blocksToImageNumPy(texels, width, height):
+    """
+    Puts blocks of (16, 4) texels in place in a row-major image
+    """
+    return texels.astype(numpy.uint8).reshape(height, width, 4, 4, 4).transpose(0, 2, 1, 3, 4).tobytes()
+
+
+def _colorPalettePython(data, pointer, fourColor):
+    """
+    Returns the (B, G, R) palette of a BC1-style color block, and
+    whether its last color is transparent
+    """
+    color0 = data[pointer] | (data[pointer + 1] << 8)
+    color1 = data[pointer + 2] | (data[pointer + 3] << 8)
+    b0, g0, r0 = Expand5[color0 & 0x1F], Expand6[(color0 >> 5) & 0x3F], Expand5[color0 >> 11]
+    b1, g1, r1 = Expand5[color1 & 0x1F], Expand6[(color1 >> 5) & 0x3F], Expand5[color1 >> 11]
+
+    if fourColor or color0 > color1:
+        return (
+            bytes((b0, g0, r0)),
+            bytes((b1, g1, r1)),
+            bytes(((b0 * 2 + b1) // 3, (g0 * 2 + g1) // 3, (r0 * 2 + r1) // 3)),
+            bytes(((b0 + b1 * 2) // 3, (g0 + g1 * 2) // 3, (r0 + r1 * 2) // 3)),
+            ), False
+    return (
+        bytes((b0, g0, r0)),
+        bytes((b1, g1, r1)),
+        bytes(((b0 + b1) // 2, (g0 + g1) // 2, (r0 + r1) // 2)),
+        bytes(3),
+        ), True
+
+
+def _interpolatedPalettePython(data, pointer, signed=False):
+    """
+    Returns the 8-entry palette of a BC3-style interpolated alpha (or
+    BC4/BC5 channel) block
+    """
+    a0, a1 = data[pointer], data[pointer + 1]
+    if signed:
+        a0 = max(a0 - 256 if a0 > 127 else a0, -127)
+        a1 = max(a1 - 256 if a1 > 127 else a1, -127)
+
+    if a0 > a1:
+        palette = [a0, a1] + [(a0 * (8 - code) + a1 * (code - 1)) // 7 for code in range(2, 8)]
+    elif signed:
+        palette = [a0, a1] + [(a0 * (6 - code) + a1 * (code - 1)) // 5 for code in range(2, 6)] + [-127, 127]
+    else:
+        palette = [a0, a1] + [(a0 * (6 - code) + a1 * (code - 1)) // 5 for code in range(2, 6)] + [0, 255]
+
+    if signed: palette = [value + 128 for value in palette]
+    return palette
+
+
+def _decodeBlocksPython(elements, width, height, decodeBlock):
+    """
+    Decodes blocks with decodeBlock(elements, pointer), which returns
+    the block's 16 texels as 4-byte B, G, R, A bytes objects
+    """
+    bytesPerBlock = len(elements) // (width * height) if width * height else 0
+    rowLength = width * 4 * 4
+    output = bytearray(rowLength * height * 4)
+
+    pointer = 0
+    for y in range(height):
+        for x in range(width):
+            texels = decodeBlock(elements, pointer)
+            pointer += bytesPerBlock
+
+            # Write the block a row at a time
+            outPos = y * 4 * rowLength + x * 16
+            for j in range(0, 16, 4):
+                output[outPos:outPos + 16] = b''.join(texels[j:j + 4])
+                outPos += rowLength
+
+    return output
+
+
+AlphaBytes = [bytes((a,)) for a in range(256)]
+
+
+def decodeBC1(elements, width, height):
+    """
+    Decodes BC1 (DXT1) blocks
+    """
+    if numpy is not None:
+        return _blocksToImageNumPy(_colorsNumPy(elements, 0, False), width, height)
+
+    def decodeBlock(data, pointer):
+        colors, transparent = _colorPalettePython(data, pointer, False)
+        alphas = (b'\xFF', b'\xFF', b'\xFF', b'\0' if transparent else b'\xFF')
+        bits = int.from_bytes(data[pointer + 4:pointer + 8], 'little')
+        return [colors[(bits >> (2 * texel)) & 3] + alphas[(bits >> (2 * texel)) & 3] for texel in range(16)]
+
+    return _decodeBlocksPython(elements, width, height, decodeBlock)
+
+
+def decodeBC2(elements, width, height):
+    """
+    Decodes BC2 (DXT3) blocks
+    """
+    if numpy is not None:
+        texels = _colorsNumPy(elements, 8, True)
+        alphaBits = elements[:, :8].copy().view('<u8').astype(numpy.uint64)
+        texels[:, :, 3] = ((alphaBits >> (numpy.arange(16, dtype=numpy.uint64) * numpy.uint64(4))[None, :]) & numpy.uint64(0xF)) * 0x11
+        return _blocksToImageNumPy(texels, width, height)
+
+    def decodeBlock(data, pointer):
+        colors, transparent = _colorPalettePython(data, pointer + 8, True)
+        colorBits = int.from_bytes(data[pointer + 12:pointer + 16], 'little')
+        alphaBits = int.from_bytes(data[pointer:pointer + 8], 'little')
+        return [colors[(colorBits >> (2 * texel)) & 3] + AlphaBytes[((alphaBits >> (4 * texel)) & 0xF) * 0x11] for texel in range(16)]
+
+    return _decodeBlocksPython(elements, width, height, decodeBlock)
+
+
+def decodeBC3(elements, width, height):
+    """
+    Decodes BC3 (DXT5) blocks. Gives the same results as
+    calculateRGBAFromDxt5AtPosition.
+    """
+    if numpy is not None:
+        texels = _colorsNumPy(elements, 8, True)
+        texels[:, :, 3] = _interpolatedNumPy(elements, 0)
+        return _blocksToImageNumPy(texels, width, height)
+
+    def decodeBlock(data, pointer):
+        alphas = [AlphaBytes[a] for a in _interpolatedPalettePython(data, pointer)]
+        alphaBits = int.from_bytes(data[pointer + 2:pointer + 8], 'little')
+        colors, transparent = _colorPalettePython(data, pointer + 8, True)
+        colorBits = int.from_bytes(data[pointer + 12:pointer + 16], 'little')
+        return [colors[(colorBits >> (2 * texel)) & 3] + alphas[(alphaBits >> (3 * texel)) & 7] for texel in range(16)]
+
+    return _decodeBlocksPython(elements, width, height, decodeBlock)
+
+
+def _decodeBC4(elements, width, height, signed):
+    if numpy is not None:
+        values = _interpolatedNumPy(elements, 0, signed)
+        texels = numpy.empty(values.shape + (4,), numpy.int32)
+        texels[:, :, :3] = values[:, :, None]
+        texels[:, :, 3] = 255
+        return _blocksToImageNumPy(texels, width, height)
+
+    grays = [bytes((value, value, value, 255)) for value in range(256)]
+    def decodeBlock(data, pointer):
+        palette = _interpolatedPalettePython(data, pointer, signed)
+        bits = int.from_bytes(data[pointer + 2:pointer + 8], 'little')
+        return [grays[palette[(bits >> (3 * texel)) & 7]] for texel in range(16)]
+
+    return _decodeBlocksPython(elements, width, height, decodeBlock)
+
+
+def decodeBC4(elements, width, height):
+    """
+    Decodes BC4 blocks, as grayscale
+    """
+    return _decodeBC4(elements, width, height, False)
+
+
+def decodeBC4Signed(elements, width, height):
+    """
+    Decodes signed BC4 blocks, as grayscale
+    """
+    return _decodeBC4(elements, width, height, True)
+
+
+def _decodeBC5(elements, width, height, signed):
+    if numpy is not None:
+        texels = numpy.zeros((len(elements), 16, 4), numpy.int32)
+        texels[:, :, 2] = _interpolatedNumPy(elements, 0, signed)
+        texels[:, :, 1] = _interpolatedNumPy(elements, 8, signed)
+        texels[:, :, 3] = 255
+        return _blocksToImageNumPy(texels, width, height)
+
+    def decodeBlock(data, pointer):
+        reds = _interpolatedPalettePython(data, pointer, signed)
+        redBits = int.from_bytes(data[pointer + 2:pointer + 8], 'little')
+        greens = _interpolatedPalettePython(data, pointer + 8, signed)
+        greenBits = int.from_bytes(data[pointer + 10:pointer + 16], 'little')
+        return [bytes((0, greens[(greenBits >> (3 * texel)) & 7], reds[(redBits >> (3 * texel)) & 7], 255)) for texel in range(16)]
+
+    return _decodeBlocksPython(elements, width, height, decodeBlock)
+
+
+def decodeBC5(elements, width, height):
+    """
+    Decodes BC5 blocks, as red and green
+    """
+    return _decodeBC5(elements, width, height, False)
+
+
+def decodeBC5Signed(elements, width, height):
+    """
+    Decodes signed BC5 blocks, as red and green
+    """
+    return _decodeBC5(elements, width, height, True)
+
+
+# Supported GX2 surface formats: name, bits per element, element size
+# in pixels and decoder. sRGB formats are decoded like their UNORM
+# counterparts.
+Formats = {
+    0x008: ('RGB565', 16, 1, decodeRGB565),
+    0x00A: ('RGB5A1', 16, 1, decodeRGB5A1),
+    0x00B: ('RGBA4', 16, 1, decodeRGBA4),
+    0x01A: ('RGBA8', 32, 1, decodeRGBA8),
+    0x41A: ('RGBA8 (sRGB)', 32, 1, decodeRGBA8),
+    0x031: ('BC1', 64, 4, decodeBC1),
+    0x431: ('BC1 (sRGB)', 64, 4, decodeBC1),
+    0x032: ('BC2', 128, 4, decodeBC2),
+    0x432: ('BC2 (sRGB)', 128, 4, decodeBC2),
+    0x033: ('BC3', 128, 4, decodeBC3),
+    0x433: ('BC3 (sRGB)', 128, 4, decodeBC3),
+    0x034: ('BC4', 64, 4, decodeBC4),
+    0x234: ('BC4 (signed)', 64, 4, decodeBC4Signed),
+    0x035: ('BC5', 128, 4, decodeBC5),
+    0x235: ('BC5 (signed)', 128, 4, decodeBC5Signed),
+    }
+
+
+def _nextPow2(value):
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def surfaceLevel(gtx, mipLevel=0):
+    """
+    Returns the data, pitch and tile mode of one mip level of a GTX
+    image. Mip levels are padded to powers of two, and ones too small
+    to fill a macro tile are 1D tiled instead of 2D tiled.
+    """
+    name, bpp, blockSize, decoder = Formats[gtx.format]
+    width = max(gtx.width >> mipLevel, 1)
+    height = max(gtx.height >> mipLevel, 1)
+    elemsWide = (width + blockSize - 1) // blockSize
+    elemsHigh = (height + blockSize - 1) // blockSize
+    tileMode = gtx.tileMode
+
+    if mipLevel == 0:
+        data = gtx.data
+        pitch = gtx.pitch
+    else:
+        if mipLevel >= gtx.numMips:
+            raise ValueError('This image has no mip level ' + str(mipLevel))
+        offset = 0 if mipLevel == 1 else gtx.mipOffsets[mipLevel - 1]
+        data = gtx.mipData[offset:]
+        pitch = 0
+
+        elemsWide = (_nextPow2(width) + blockSize - 1) // blockSize
+        elemsHigh = (_nextPow2(height) + blockSize - 1) // blockSize
+        if tileMode == 4 and (elemsWide < 32 * max(256 // bpp // 8, 1) or elemsHigh < 16):
+            tileMode = 2
+
+    if not pitch:
+        # Work out the pitch from the alignment the tile mode needs
+        if tileMode == 4:
+            pitch = _align(elemsWide, 32 * max(256 // bpp // 8, 1))
+        elif tileMode in (2, 3):
+            pitch = _align(elemsWide, max(8, 256 // bpp))
         else:
-            yield img.copy(0, 0, gtx.width, gtx.height)
+            pitch = _align(elemsWide, max(64, 256 // (bpp // 8)))
+
+    return data, pitch, tileMode
+
+
+def decodeGTX(gtx, mipLevel=0):
+    """
+    Decodes one mip level of a GTX image. Returns its pixels in
+    row-major order as B, G, R, A bytes (QImage.Format_ARGB32).
+    """
+    if gtx.format not in Formats:
+        raise NotImplementedError('Unknown texture format: ' + hex(gtx.format))
+    name, bpp, blockSize, decoder = Formats[gtx.format]
+    data, pitch, tileMode = surfaceLevel(gtx, mipLevel)
+
+    width = max(gtx.width >> mipLevel, 1)
+    height = max(gtx.height >> mipLevel, 1)
+    elemsWide = (width + blockSize - 1) // blockSize
+    elemsHigh = (height + blockSize - 1) // blockSize
+
+    elements = deswizzle(data, elemsWide, elemsHigh, bpp, pitch, tileMode, gtx.swizzle)
+    output = decoder(elements, elemsWide, elemsHigh)
+
+    # Crop blocks that go past the edges of the image
+    decodedWidth = elemsWide * blockSize
+    if decodedWidth != width or elemsHigh * blockSize != height:
+        rowLength = decodedWidth * 4
+        output = b''.join([output[y * rowLength:y * rowLength + width * 4] for y in range(height)])
+
+    return output
+
+
+def swapRedBlue(pixels):
+    """
+    Converts B, G, R, A pixels to R, G, B, A (or back)
+    """
+    if numpy is not None:
+        pixels = numpy.frombuffer(pixels, numpy.uint8).reshape(-1, 4)
+        return pixels[:, [2, 1, 0, 3]].tobytes()
+
+    output = bytearray(pixels)
+    output[0::4] = pixels[2::4]
+    output[2::4] = pixels[0::4]
+    return output
+
+
+def decodeGTXData(data, mipLevel=0, channelOrder='BGRA'):
+    """
+    Decodes GTX file data. Returns (pixels, width, height), where pixels
+    is a contiguous buffer of width * height pixels in row-major order,
+    with their channels in channelOrder ('BGRA' or 'RGBA'). Doesn't use
+    Qt.
+    """
+    gtx = loadGTX(data)
+    pixels = decodeGTX(gtx, mipLevel)
+    if channelOrder == 'RGBA':
+        pixels = swapRedBlue(pixels)
+    elif channelOrder != 'BGRA':
+        raise ValueError('Unknown channel order: ' + channelOrder)
+    return pixels, max(gtx.width >> mipLevel, 1), max(gtx.height >> mipLevel, 1)
+
+
+def decodeGTXInto(data, blockName, mipLevel=0):
+    """
+    Decodes GTX file data into an existing shared memory block, as B, G,
+    R, A pixels. Meant to be run in a worker process; the caller creates
+    the block (width * height * 4 bytes long) and frees it. Returns the
+    width and height.
+    """
+    pixels, width, height = decodeGTXData(data, mipLevel)
+    block = shared_memory.SharedMemory(blockName)
+    try:
+        block.buf[:len(pixels)] = pixels
+    finally:
+        block.close()
+    return width, height
 
 
 def calculateRGBAFromDxt5AtPosition(width, pixdata, i, j):
@@ -461,6 +1062,24 @@ def calculateRGBFromDxtAtPosition(pixdata, pointer, i, j, dxt_type):
     return a, r, g, b
 
 
+################################################################
+# Qt wrappers
+
+def imageFromPixels(pixels, width, height):
+    """
+    Makes a QImage from decoded B, G, R, A pixels
+    """
+    img = QtGui.QImage(pixels, width, height, width * 4, QtGui.QImage.Format_ARGB32)
+    return img.copy()
+
+
+def renderGTX(gtxObj):
+    """
+    Renders a GTX object.
+    """
+    yield imageFromPixels(decodeGTX(gtxObj), gtxObj.width, gtxObj.height)
+
+
 def main():
     """
     This script allows you to run this module as a standalone Python program.
@@ -473,7 +1092,7 @@ def main():
     with open(inf, 'rb') as inf:
         inb = inf.read()
 
-    outImg = renderGTX(loadGTX(inb))
+    outImg = next(renderGTX(loadGTX(inb)))
     outImg.save(outf)
 
 if __name__ == '__main__': main()
\ No newline at end of file
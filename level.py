@@ -90,6 +90,10 @@ class Level_NSMBU(AbstractLevel):
         super().__init__()
         self.areas.append(Area_NSMBU())
 
+        # The outer archive the level was loaded from, if any. Saving
+        # patches it, so that unchanged resources are reused as-is.
+        self.sourceArchive = None
+
     def load(self, data, areaNum, progress=None):
         """
         Loads a NSMBU level from bytes data.
@@ -162,9 +166,11 @@ class Level_NSMBU(AbstractLevel):
 
         return True
 
-    def save(self, innerfilename):
+    def save(self, innerfilename, out=None):
         """
-        Save the level back to a file
+        Save the level back to a file. If out (a file object or a
+        bytearray) is given, the level is written to it instead of
+        being returned.
         """
 
         # Make a new archive
@@ -190,10 +196,9 @@ class Level_NSMBU(AbstractLevel):
         # Here we have the new inner-SARC savedata
         innersarc = newArchive.save(0x04, 0x170)
 
-        # Now make an outer SARC
-        outerArchive = SarcLib.SARC_Archive()
+        # Work out what goes in the outer SARC
         fn = innerfilename
-        outerArchive.addFile(SarcLib.File(fn, innersarc))
+        outerFiles = {fn: innersarc}
         for szsThingName in szsData:
             try:
                 spl = szsThingName.split('-')
@@ -201,13 +206,27 @@ class Level_NSMBU(AbstractLevel):
                 int(spl[1])
                 continue
             except: pass
-            outerArchive.addFile(SarcLib.File(szsThingName, szsData[szsThingName]))
+            outerFiles[szsThingName] = szsData[szsThingName]
 
         # Make it easy for future Reggies to pick out the level name
-        outerArchive.addFile(SarcLib.File('levelname', fn.encode('utf-8')))
-
+        outerFiles['levelname'] = fn.encode('utf-8')
+
+        # Update the archive the level came from, so that it can be
+        # saved by patching only what changed; or make a new one
+        outerArchive = self.sourceArchive
+        if outerArchive is None:
+            outerArchive = SarcLib.SARC_Archive()
+        for path, file in list(outerArchive):
+            if path not in outerFiles: del outerArchive[path]
+        for name, data in outerFiles.items():
+            if name in outerArchive and outerArchive[name].data is data: continue
+            outerArchive[name] = SarcLib.File(name, data)
+
+        if out is not None:
+            outerArchive.saveTo(out, 0x2000, incremental=True)
+            return
 
-        return outerArchive.save(0x2000)
+        return outerArchive.save(0x2000, incremental=True)
 
 
     def addArea(self):
@@ -6,67 +6,178 @@ class LZS11(object):
 		self.decomp_size = 0
 		self.curr_size = 0
 		self.compressed = True
-		self.outdata = []
+		self.outdata = bytearray()
 	def Decompress11LZS( self , filein ):
-		offset = 0
 		# check that file is < 2GB
-		#print "length of file: 0x%x" % len(filein)
 		assert len(filein) < ( 0x4000 * 0x4000 * 2 )
-		self.magic = struct.unpack('<B', filein[0:1])[0]
-		#print "magic = 0x%x" % self.magic
+		self.magic = filein[0]
 		assert self.magic == 0x11
-		self.decomp_size = struct.unpack('<I', filein[offset:offset+4])[0] >> 8
-		offset += 4
-		assert self.decomp_size <= 0x200000
-		if ( self.decomp_size == 0 ):
-			self.decomp_size = struct.unpack('<I', filein[offset:offset+4])[0]
-			offset += 4
+		self.decomp_size = getDecompressedSize11(filein)
 		assert self.decomp_size <= 0x200000 << 8
 
-		#print "Decompressing 0x%x. (outsize: 0x%x)" % (len(filein), self.decomp_size)
-		self.outdata = [0 for x in range(self.decomp_size)]
-
-		while self.curr_size < self.decomp_size and offset < len(filein):
-			flags = struct.unpack('<B', filein[offset:offset+1])[0]
-			offset += 1
-
-			for i in range(8):
-				x = 7 - i
-				if self.curr_size >= self.decomp_size:
-					break
-				if (flags & (1 << x)) > 0:
-					first = struct.unpack('<B', filein[offset:offset+1])[0]
-					offset += 1
-					second = struct.unpack('<B', filein[offset:offset+1])[0]
-					offset += 1
-
-					if first < 0x20:
-						third = struct.unpack('<B', filein[offset:offset+1])[0]
-						offset += 1
-
-						if first >= 0x10:
-							fourth = struct.unpack('<B', filein[offset:offset+1])[0]
-							offset += 1
-
-							pos = (((third & 0xF) << 8) | fourth) + 1
-							copylen = ((second << 4) | ((first & 0xF) << 12) | (third >> 4)) + 273
-						else:
-							pos = (((second & 0xF) << 8) | third) + 1
-							copylen = (((first & 0xF) << 4) | (second >> 4)) + 17
+		self.outdata = decompress11(filein)
+		self.curr_size = len(self.outdata)
+		return self.outdata
+	def Compress11LZS( self , filein ):
+		self.decomp_size = len(filein)
+		return compress11(filein)
+
+
+def getDecompressedSize11(data):
+	"""
+	Reads the decompressed size from an LZ11 header
+	"""
+	size = struct.unpack_from('<I', data)[0] >> 8
+	if size == 0:
+		size = struct.unpack_from('<I', data, 4)[0]
+	return size
+
+
+def decompress11(data):
+	"""
+	Decompresses LZ11 data straight into a preallocated bytearray,
+	copying back-references with slices
+	"""
+	src = memoryview(data)
+	srclen = len(src)
+	size = getDecompressedSize11(src)
+	offset = 8 if src[1] == src[2] == src[3] == 0 else 4
+
+	out = bytearray(size)
+	outpos = 0
+
+	while outpos < size and offset < srclen:
+		flags = src[offset]
+		offset += 1
+
+		for i in range(8):
+			if outpos >= size or offset >= srclen:
+				break
+
+			if flags & 0x80:
+				first = src[offset]
+				second = src[offset + 1]
+
+				if first < 0x20:
+					third = src[offset + 2]
+
+					if first >= 0x10:
+						fourth = src[offset + 3]
+						offset += 4
+						pos = (((third & 0xF) << 8) | fourth) + 1
+						copylen = ((second << 4) | ((first & 0xF) << 12) | (third >> 4)) + 273
 					else:
-						pos = (((first & 0xF) << 8) | second) + 1
-						copylen = (first >> 4) + 1
+						offset += 3
+						pos = (((second & 0xF) << 8) | third) + 1
+						copylen = (((first & 0xF) << 4) | (second >> 4)) + 17
+				else:
+					offset += 2
+					pos = (((first & 0xF) << 8) | second) + 1
+					copylen = (first >> 4) + 1
 
-					for y in range(copylen):
-						self.outdata[self.curr_size + y] = self.outdata[self.curr_size - pos + y]
+				if copylen > size - outpos:
+					copylen = size - outpos
+				start = outpos - pos
+				if start < 0:
+					raise ValueError('Invalid LZ11 back-reference')
 
-					self.curr_size += copylen
+				if pos >= copylen:
+					out[outpos:outpos + copylen] = out[start:start + copylen]
 				else:
+					# Overlapping copy: the last pos bytes repeat
+					out[outpos:outpos + copylen] = (out[start:outpos] * (copylen // pos + 1))[:copylen]
+				outpos += copylen
+			else:
+				out[outpos] = src[offset]
+				offset += 1
+				outpos += 1
 
-					self.outdata[self.curr_size] = struct.unpack('<B', filein[offset:offset+1])[0]
-					offset += 1
-					self.curr_size += 1
+			flags <<= 1
 
-				if offset >= len(filein) or self.curr_size >= self.decomp_size:
-					break
-		return self.outdata
+	return out
+
+
+def compress11(data, maxChain=256):
+	"""
+	Compresses data to LZ11, finding matches with hash chains over
+	the 0x1000-byte window. maxChain limits how many earlier positions
+	are tried for each match; lower is faster but compresses worse.
+	"""
+	data = bytes(data)
+	size = len(data)
+
+	# A size of 0 in the short header means the real size follows,
+	# so empty data needs the extended header too
+	if 0 < size < 0x1000000:
+		out = bytearray(struct.pack('<I', (size << 8) | 0x11))
+	else:
+		out = bytearray(struct.pack('<II', 0x11, size))
+
+	WINDOW = 0x1000
+	MAXLEN = 0x10110 # 65808, the longest four-byte match
+	mask = WINDOW - 1
+	lastKeyPos = size - 2
+
+	# head maps each 3-byte string to the latest position it was seen at;
+	# prev links each position to the previous one with the same 3 bytes
+	# (as a ring buffer, since only the window matters).
+	head = {}
+	prev = [-1] * WINDOW
+
+	flagPos = 0
+	bits = 0
+	pos = 0
+	while pos < size:
+		if not bits:
+			flagPos = len(out)
+			out.append(0)
+			bits = 8
+		bits -= 1
+
+		# Find the longest match
+		maxLen = size - pos
+		if maxLen > MAXLEN: maxLen = MAXLEN
+		bestLen = 2
+		bestDist = 0
+		if maxLen >= 3:
+			limit = pos - WINDOW
+			cand = head.get(data[pos:pos + 3], -1)
+			chain = maxChain
+			while cand >= limit and cand >= 0 and chain:
+				if data[cand + bestLen] == data[pos + bestLen]:
+					length = 3
+					while length + 64 <= maxLen and data[cand + length:cand + length + 64] == data[pos + length:pos + length + 64]:
+						length += 64
+					while length < maxLen and data[cand + length] == data[pos + length]:
+						length += 1
+					if length > bestLen:
+						bestLen, bestDist = length, pos - cand
+						if length >= maxLen: break
+				cand = prev[cand & mask]
+				chain -= 1
+
+		if bestDist:
+			out[flagPos] |= 1 << bits
+			dist = bestDist - 1
+			if bestLen <= 16:
+				out += bytes((((bestLen - 1) << 4) | (dist >> 8), dist & 0xFF))
+			elif bestLen <= 272:
+				length = bestLen - 17
+				out += bytes((length >> 4, ((length & 0xF) << 4) | (dist >> 8), dist & 0xFF))
+			else:
+				length = bestLen - 273
+				out += bytes((0x10 | (length >> 12), (length >> 4) & 0xFF, ((length & 0xF) << 4) | (dist >> 8), dist & 0xFF))
+			end = pos + bestLen
+		else:
+			out.append(data[pos])
+			end = pos + 1
+
+		# Add the covered positions to the hash chains
+		for p in range(pos, end if end < lastKeyPos else lastKeyPos):
+			key = data[p:p + 3]
+			prev[p & mask] = head.get(key, -1)
+			head[key] = p
+
+		pos = end
+
+	return bytes(out)
@@ -42,6 +42,7 @@ if currentRunningVersion < minimum:
 import base64
 import importlib
 from math import floor as math_floor
+import multiprocessing
 import os.path
 import pickle
 import struct
@@ -71,6 +72,7 @@ except (ImportError, NameError):
 
 # Local imports
 import archive
+import compression
 from dialog import * # bad but w/e
 import level
 import LHTool
@@ -202,40 +204,26 @@ def module_path():
         return os.path.dirname(os.path.abspath(sys.argv[0]))
     return None
 
-compressed = False
-def checkContent(data):
-    if not data.startswith(b'SARC'):
-        return False
-
-    required = (b'course/', b'course1.bin')
-    for r in required:
-        if r not in data:
-            return False
-
-    return True
-
 def IsNSMBLevel(filename):
-    global compressed
     """
     Does some basic checks to confirm a file is a NSMB level
     """
-    return True
     if not os.path.isfile(filename): return False
 
-    f = open(filename, 'rb')
-    data = f.read()
-    f.close()
-    del f
+    with open(filename, 'rb') as f:
+        data = f.read()
 
-    if LHTool.isLHCompressed(data):
-        decomp = LHTool.decompressLH(data)
-        if checkContent(decomp):
-            compressed = True
-            return True
-    else:
-        if checkContent(data):
-            compressed = False
-            return True
+    # Only the SARC header is needed, so don't decompress the whole
+    # level just to look at it. The course files themselves are in an
+    # archive nested inside this one, so their names can't be checked
+    # here without unpacking that too.
+    try:
+        header = compression.decompressPrefix(data, 0x18)
+    except (ValueError, IndexError, struct.error):
+        # The decoders don't all check their input, so corrupt data
+        # can fail in any of these ways
+        return False
+    return header[:4] == b'SARC' and header[0x14:0x18] == b'SFAT'
 
 
 def FilesAreMissing():
@@ -3793,14 +3781,9 @@ class ObjectPickerWidget(QtWidgets.QListView):
                     x = 0
                     for tile in row:
                         if tile != -1:
-                            if Tiles[tile].main is None:
-                                # This can and does happen because of the new
-                                # thread-based progressive tileset rendering.
-                                pass
-                            elif isinstance(Tiles[tile].main, QtGui.QImage):
-                                p.drawImage(x, y, Tiles[tile].main)
-                            else:
-                                p.drawPixmap(x, y, Tiles[tile].main)
+                            # This draws nothing if the tileset hasn't been
+                            # decoded yet
+                            Tiles[tile].drawMain(p, x, y)
                             if isinstance(Tiles[tile], TilesetTile) and Tiles[tile].isAnimated: isAnim = True
                         x += tile.TileWidth
                     y += tile.TileWidth
@@ -4106,9 +4089,7 @@ class Stamp():
                     for tile in row:
                         if tile > 0:
                             if Tiles[tile] is None: continue
-                            r = Tiles[tile].main
-                            if r is None: continue
-                            painter.drawPixmap(destx + drawOffsetX, desty + drawOffsetY, r)
+                            Tiles[tile].drawMain(painter, destx + drawOffsetX, desty + drawOffsetY)
                         destx += tile.TileWidth
                     desty += tile.TileWidth
                 painter.restore()
@@ -6871,24 +6852,34 @@ class LevelScene(QtWidgets.QGraphicsScene):
 
                 painter.save()
                 painter.translate(x1 * tile.TileWidth, y1 * tile.TileWidth)
-                drawPixmap = painter.drawPixmap
+
+                # Group the tiles by the pixmap they come from (mostly their
+                # tileset's atlas), and draw each group in one go
+                tileWidth = tile.TileWidth
+                createFragment = QtGui.QPainter.PixmapFragment.create
+                sources = {}
+                fragments = {}
                 desty = 0
                 for row in tmap:
                     destx = 0
-                    for tile in row:
-                        pix = None
-
-                        if tile == -1:
-                            # Draw unknown tiles
-                            pix = None#Overrides[108].getCurrentTile()
-                        elif tile is not None:
-                            pix = tiles[tile].getCurrentTile()
-
-                        if pix is not None:
-                            painter.drawPixmap(destx, desty, pix)
-
-                        destx += tile.TileWidth
-                    desty += tile.TileWidth
+                    for tilenum in row:
+                        # Unknown tiles (-1) aren't drawn
+                        if tilenum is not None and tilenum != -1 and tiles[tilenum] is not None:
+                            pix, source = tiles[tilenum].getCurrentSource()
+                            if pix is not None:
+                                if source is None: source = QtCore.QRectF(pix.rect())
+                                key = pix.cacheKey()
+                                if key not in sources:
+                                    sources[key] = pix
+                                    fragments[key] = []
+                                fragments[key].append(createFragment(
+                                    QtCore.QPointF(destx + source.width() / 2, desty + source.height() / 2), source))
+
+                        destx += tileWidth
+                    desty += tileWidth
+
+                for key, pix in sources.items():
+                    painter.drawPixmapFragments(fragments[key], pix)
                 painter.restore()
 
 
@@ -12660,6 +12651,7 @@ class ReggieWindow(QtWidgets.QMainWindow):
         """
         self.levelOverview.Xposlocator = pos
         self.levelOverview.update()
+        tile.PrioritizeVisibleTilesets()
 
     @QtCore.pyqtSlot(int)
     def YScrollChange(self, pos):
@@ -12668,6 +12660,7 @@ class ReggieWindow(QtWidgets.QMainWindow):
         """
         self.levelOverview.Yposlocator = pos
         self.levelOverview.update()
+        tile.PrioritizeVisibleTilesets()
 
     @QtCore.pyqtSlot(int, int)
     def HandleWindowSizeChange(self, w, h):
@@ -13467,8 +13460,7 @@ class ReggieWindow(QtWidgets.QMainWindow):
 
         with open(str(fn), 'rb') as fileobj:
             arcdata = fileobj.read()
-        if LHTool.isLHCompressed(arcdata):
-            arcdata = LHTool.decompressLH(arcdata)
+        arcdata = compression.decompress(arcdata)
 
         arc = SarcLib.SARC_Archive()
         arc.load(arcdata)
@@ -13539,7 +13531,7 @@ class ReggieWindow(QtWidgets.QMainWindow):
         # no error checking. if it saved last time, it will probably work now
 
         with open(self.fileSavePath, 'wb') as f:
-            f.write(Level.save(self.getInnerSarcName()))
+            Level.save(self.getInnerSarcName(), f)
         self.LoadLevel(None, self.fileSavePath, True, 1)
 
 
@@ -14293,10 +14285,6 @@ class ReggieWindow(QtWidgets.QMainWindow):
             with open(self.fileSavePath, 'rb') as fileobj:
                 levelData = fileobj.read()
 
-            # Decompress, if needed
-            if LHTool.isLHCompressed(levelData):
-                levelData = LHTool.decompressLH(levelData)
-
         else:
             # Auto-saved level. Check if there's a path associated with it:
 
@@ -14319,16 +14307,19 @@ class ReggieWindow(QtWidgets.QMainWindow):
         Dirty = False
         DirtyOverride += 1
 
-        # Decompress it (Yaz0)
-        if levelData.startswith(b'Yaz0'):
-            print('Beginning Yaz0 decompression...')
-            levelData = yaz0.decompress(levelData)
+        # Decompress it (Yaz0, LH or LZ11), if needed
+        codec = compression.sniff(levelData)
+        if codec is not None:
+            print('Beginning %s decompression...' % codec.name)
+            levelData = compression.decompress(levelData)
             print('Decompression finished.')
         else:
-            print('Yaz0 decompression skipped.')
+            print('Decompression skipped.')
 
+        # Load the archive lazily, so that the embedded tileset archives
+        # and resources aren't copied out of levelData
         arc = SarcLib.SARC_Archive()
-        arc.load(levelData)
+        arc.load(levelData, lazy=True)
 
         def exists(fn):
             nonlocal arc
@@ -14338,13 +14329,13 @@ class ReggieWindow(QtWidgets.QMainWindow):
 
         possibilities = []
         if exists('levelname'):
-            possibilities.append(arc['levelname'].data.decode('utf-8'))
+            possibilities.append(bytes(arc['levelname'].data).decode('utf-8'))
         possibilities.append(os.path.basename(name))
         possibilities.append(possibilities[-1].split()[-1]) # for formats like "NSMBU 1-1.szs"
         possibilities.append(possibilities[-1].split('.')[0])
         for fn in possibilities:
             if exists(fn):
-                levelFileData = arc[fn].data
+                levelFileData = arc[fn].materialize()
                 break
         else:
             return False
@@ -14415,6 +14406,10 @@ class ReggieWindow(QtWidgets.QMainWindow):
         elif game is NewSuperLuigiU:
             self.LoadLevel_NSMBU(levelData, areaNum, progress)
 
+        # Keep the outer archive, so that saving can reuse the parts of
+        # it that weren't edited
+        Level.sourceArchive = arc
+
         # Set the level overview settings
         mainWindow.levelOverview.maxX = 100
         mainWindow.levelOverview.maxY = 40
@@ -14439,6 +14434,7 @@ class ReggieWindow(QtWidgets.QMainWindow):
         self.view.centerOn(0, 0)
         if startEnt is not None: self.view.centerOn(startEnt.objx * (tile.TileWidth/16), startEnt.objy * (tile.TileWidth/16))
         self.ZoomTo(100.0)
+        tile.PrioritizeVisibleTilesets()
 
         # Reset some editor things
         if UseRibbon:
@@ -15920,6 +15916,10 @@ def main():
 
     global app, mainWindow, settings, ReggieVersion
 
+    # tilesets are decoded in worker processes, which frozen builds
+    # have to be able to start
+    multiprocessing.freeze_support()
+
     # create an application
     app = QtWidgets.QApplication(sys.argv)
 
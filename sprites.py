@@ -77,7 +77,7 @@ class SpriteImage_Block(SLib.SpriteImage): # 59, 60
 
         painter.setRenderHint(QtGui.QPainter.Antialiasing)
         if self.tilenum < len(SLib.Tiles):
-            painter.drawPixmap(0, 0, SLib.Tiles[self.tilenum].main)
+            SLib.Tiles[self.tilenum].drawMain(painter, 0, 0)
         painter.drawPixmap(0, 0, self.image)
 
 class SpriteImage_Goomba(SLib.SpriteImage_Static): # 0
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Reggie! - New Super Mario Bros. Wii Level Editor
+# Version Next Milestone 2 Alpha 4
+# Copyright (C) 2009-2014 Treeki, Tempus, angelsl, JasonP27, Kamek64,
+# MalStar1000, RoadrunnerWMC
+
+# This file is part of Reggie!.
+
+# Reggie! is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Reggie! is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Reggie!.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# test_LHTool.py
+# Conformance test for LHTool: random data is encoded into valid LH
+# streams, which decompressLH and decompressLHReference must both
+# decode back to the original data. Run it with pytest, or directly.
+
+
+################################################################
+################################################################
+
+
+import heapq
+import random
+import sys
+
+import LHTool
+
+
+################################################################
+# A minimal LH encoder, only meant to produce test input for the
+# decoders, not to compress files for the game.
+
+class BitWriter():
+    """
+    Writes bits MSB-first, the order the LH decoder reads them in
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.bitBuf = 0
+        self.bitCount = 0
+
+    def write(self, value, bits):
+        self.bitBuf = (self.bitBuf << bits) | (value & ((1 << bits) - 1))
+        self.bitCount += bits
+        while self.bitCount >= 8:
+            self.bitCount -= 8
+            self.data.append((self.bitBuf >> self.bitCount) & 0xFF)
+        self.bitBuf &= (1 << self.bitCount) - 1
+
+    def flush(self):
+        if self.bitCount:
+            self.write(0, 8 - self.bitCount)
+        return self.data
+
+
+def huffmanTree(freqs):
+    """
+    Builds a Huffman tree for the symbol frequencies given (a dict).
+    Leaves are symbols and other nodes are (child 0, child 1) tuples.
+    """
+    heap = [(freq, i, sym) for i, (sym, freq) in enumerate(sorted(freqs.items()))]
+    heapq.heapify(heap)
+    order = len(heap)
+    while len(heap) > 1:
+        a = heapq.heappop(heap)
+        b = heapq.heappop(heap)
+        heapq.heappush(heap, (a[0] + b[0], order, (a[2], b[2])))
+        order += 1
+    return heap[0][2]
+
+
+def randomTree(symbols, rand):
+    """
+    Builds a tree of random shape over the symbols given. Lopsided
+    splits are likely, so some codes get much longer than a Huffman
+    tree would make them.
+    """
+    symbols = list(symbols)
+    rand.shuffle(symbols)
+
+    def split(start, end):
+        if end - start == 1: return symbols[start]
+        cut = rand.choice((start + 1, end - 1, rand.randint(start + 1, end - 1)))
+        return (split(start, cut), split(cut, end))
+
+    return split(0, len(symbols))
+
+
+def packLHTree(root, bits, offsetMask, leafFlag):
+    """
+    Packs a tree into a table as it appears in the LH header, and
+    returns it with a dict mapping each symbol to its code as
+    (value, length).
+
+    The tree is laid out breadth-first: entry 1 is the root, and the
+    children of a node are the pair of entries at (node & ~1) +
+    ((offset + 1) << 1), where the low bits of the node's entry hold
+    the offset and leafFlag >> bit marks a child as a leaf. Raises
+    ValueError if an offset doesn't fit in offsetMask.
+    """
+    entries = [0, 0]
+    codes = {}
+    queue = [(root, 1, 0, 0)]
+    for node, index, code, length in queue:
+        pair = len(entries) >> 1
+        offset = pair - (index >> 1) - 1
+        if offset > offsetMask:
+            raise ValueError('Tree is too wide for an LH table')
+
+        entry = offset
+        entries += [0, 0]
+        for bit, child in enumerate(node):
+            childIndex = (pair << 1) + bit
+            if isinstance(child, tuple):
+                queue.append((child, childIndex, (code << 1) | bit, length + 1))
+            else:
+                entry |= leafFlag >> bit
+                entries[childIndex] = child
+                codes[child] = ((code << 1) | bit, length + 1)
+        entries[index] = entry
+
+    # The table is padded to a multiple of 4 bytes, with some room to
+    # spare so the loader doesn't stop before the last entry. The 9-bit
+    # loader reads two bytes at a time every 8 entries, and would read
+    # one byte past a table that ends in the middle of such a read.
+    countBytes = 2 if bits > 8 else 1
+    size = countBytes + ((len(entries) - 1) * bits + 7) // 8 + 1
+    count = (size + 3) // 4 - 1
+    while bits == 9 and (((count + 1) << 2) - countBytes) % 9 == 1:
+        count += 1
+
+    writer = BitWriter()
+    for entry in entries[1:]:
+        writer.write(entry, bits)
+    table = count.to_bytes(countBytes, 'little') + writer.flush()
+    table += bytes(((count + 1) << 2) - len(table))
+
+    return table, codes
+
+
+def buildLHTree(freqs, bits, offsetMask, leafFlag, rand=None):
+    """
+    Returns the packed table and codes (see packLHTree) for a tree
+    over the symbols in freqs. This is a Huffman tree, or one of random
+    shape if rand (a random.Random) is given and it fits in the table.
+    """
+    # Always have at least two leaves, so every symbol gets a code
+    freqs = dict(freqs)
+    for sym in range(2):
+        if len(freqs) >= 2: break
+        freqs.setdefault(sym, 0)
+
+    if rand is not None:
+        for attempt in range(10):
+            try:
+                return packLHTree(randomTree(sorted(freqs), rand), bits, offsetMask, leafFlag)
+            except ValueError:
+                pass
+
+    return packLHTree(huffmanTree(freqs), bits, offsetMask, leafFlag)
+
+
+def encodeLH(data, window=0x200, rand=None):
+    """
+    Compresses data into a valid LH stream with a simple greedy
+    matcher. This is only meant to produce test input for the
+    decoders, not to compress files for the game. If rand is given,
+    the Huffman trees are replaced with randomly shaped ones.
+    """
+    tokens = []
+    pos = 0
+    while pos < len(data):
+        best, bestDist = 0, 0
+        for dist in range(1, min(pos, window) + 1):
+            length = 0
+            while (length < 258 and pos + length < len(data)
+                    and data[pos + length] == data[pos + length - dist]):
+                length += 1
+            if length > best:
+                best, bestDist = length, dist
+        if best >= 3:
+            tokens.append((0x100 + best - 3, bestDist))
+            pos += best
+        else:
+            tokens.append((data[pos], None))
+            pos += 1
+
+    def distCode(dist):
+        value = dist - 1
+        return value.bit_length(), value
+
+    symFreqs = {}
+    distFreqs = {}
+    for sym, dist in tokens:
+        symFreqs[sym] = symFreqs.get(sym, 0) + 1
+        if dist is not None:
+            distBits = distCode(dist)[0]
+            distFreqs[distBits] = distFreqs.get(distBits, 0) + 1
+
+    symTable, symCodes = buildLHTree(symFreqs, 9, 0x7F, 0x100, rand)
+    distTable, distCodes = buildLHTree(distFreqs, 5, 7, 0x10, rand)
+
+    writer = BitWriter()
+    for sym, dist in tokens:
+        writer.write(*symCodes[sym])
+        if dist is None: continue
+
+        distBits, value = distCode(dist)
+        writer.write(*distCodes[distBits])
+        if distBits > 1:
+            writer.write(value, distBits - 1)
+
+    body = writer.flush()
+    body += bytes(-len(body) % 4)
+
+    return b'@' + len(data).to_bytes(3, 'little') + symTable + distTable + bytes(body)
+
+
+################################################################
+
+def generateData(rand):
+    """
+    Returns random data that mixes literals, repeats from all distances
+    and runs (overlapping copies), so that every kind of code gets
+    exercised
+    """
+    data = bytearray()
+    size = rand.randint(1, 0x1000)
+    alphabet = bytes(rand.sample(range(256), rand.randint(1, 64)))
+    while len(data) < size:
+        kind = rand.random()
+        if kind < 0.4 or not data:
+            data += bytes(rand.choice(alphabet) for j in range(rand.randint(1, 16)))
+        elif kind < 0.7:
+            start = rand.randrange(max(0, len(data) - 0x200), len(data))
+            data += data[start:start + rand.randint(3, 300)]
+        else:
+            data += bytes([rand.choice(alphabet)]) * rand.randint(3, 300)
+    return bytes(data[:size])
+
+
+def generatedStreams(count=50, seed=0):
+    """
+    Yields (data, LH stream) pairs. Every other stream uses randomly
+    shaped trees, whose long codes go past the decoder's lookup tables.
+    """
+    rand = random.Random(seed)
+    for i in range(count):
+        data = generateData(rand)
+        yield data, encodeLH(data, rand=rand if i & 1 else None)
+
+
+def test_decompressLH():
+    for data, stream in generatedStreams():
+        assert LHTool.decompressLH(stream) == data
+
+
+def test_decompressLHReference():
+    for data, stream in generatedStreams():
+        assert LHTool.decompressLHReference(stream) == data
+
+
+def main():
+    """
+    Checks both decompressors on the generated streams, printing one
+    line per stream
+    """
+    failures = 0
+    for i, (data, stream) in enumerate(generatedStreams()):
+        try:
+            ok = LHTool.decompressLH(stream) == data and LHTool.decompressLHReference(stream) == data
+        except (ValueError, IndexError):
+            ok = False
+        if not ok: failures += 1
+        print('Stream {0}: {1} ({2} -> {3} bytes)'.format(i, 'OK' if ok else 'MISMATCH', len(data), len(stream)))
+
+    print('{0} failed'.format(failures))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__': sys.exit(main())
@@ -30,11 +30,20 @@
 ################################################################
 
 import reggie
+import collections
+import compression
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import gtx
 import level
+import multiprocessing
+import os
 import threading
 from PyQt5 import QtCore, QtGui, QtWidgets # if reggie.py has it, this should have it
 import SARC as SarcLib
 import spritelib as SLib
+import tilecache
 
 Qt = QtCore.Qt
 
@@ -45,102 +54,338 @@ TilesetFilesLoaded = [None, None, None, None]
 TilesetAnimTimer = None
 TilesetCache = {} # Tileset cache, to avoid reloading when possible
 TilesetCompletelyCached = {}
-TileThreads = [None, None, None, None] # holds tileset-rendering threads
+DecodeScheduler = None # decodes tileset textures in the background
+TilesetAtlases = [None, None, None, None] # one pixmap with all the tiles, per tileset
+TilesetDiskCache = None # decoded tilesets on disk, by archive hash
+TilesetDiskCacheKeys = [None, None, None, None] # keys of the tilesets being decoded
 TileBehaviours = None
 ObjectDefinitions = None # 4 tilesets
 TilesetsAnimating = False
+RenderedObjects = collections.OrderedDict() # (tileset, objnum, width, height, fullslope) -> tile grid
+RenderedObjectsLimit = 4096 # how many RenderedObjects to keep
 
-class StoppableThread(threading.Thread):
+class TilesetDecodeScheduler(QtCore.QObject):
     """
-    Thread class with a stop() method. The thread itself has to check
-    regularly for the stopped() condition.
-    http://stackoverflow.com/a/325528
+    Decodes tileset textures in a pool of worker processes, at full
+    speed, and hands each one back to the GUI thread once through a
+    signal. Decoded pixels come back through shared memory. Tilesets
+    with more objects in the visible part of the level are decoded
+    first. If previews are enabled, a low-res preview is first published
+    from the texture's second mip level, if it has one.
+
+    If a process pool can't be used, textures are decoded on the
+    scheduler's own background thread instead.
     """
+    # slot, tileset name, generation, pixels, width, height, is preview
+    decoded = QtCore.pyqtSignal(int, str, int, object, int, int, bool)
+
+    def __init__(self, previews=False, processes=None):
+        super().__init__()
+        self.previews = previews
+        self.jobs = {} # slot -> [name, texture data, generation, preview pending, in thread]
+        self.generations = [0, 0, 0, 0]
+        self.visibleCounts = [0, 0, 0, 0]
+        self.condition = threading.Condition()
+
+        self.decoded.connect(self.handleDecoded)
+
+        # Only hand the pool as many textures as it can work on at once,
+        # so that priorities still apply to the rest
+        processes = processes or os.cpu_count() or 1
+        self.workers = threading.Semaphore(processes)
+        if gtx.shared_memory is not None and os.name == 'posix':
+            # Start the shared memory tracker before the workers, so
+            # that they share it rather than each starting their own
+            # (which would "clean up" blocks we've already freed)
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        try:
+            # Spawn the workers rather than forking them, since forking a
+            # process that's already running Qt and other threads can
+            # deadlock the child
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('spawn'))
+        except (ImportError, NotImplementedError, OSError):
+            self.executor = None
+
+        self.thread = threading.Thread(target=self.run, name='TilesetDecodeScheduler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def schedule(self, idx, name, comptiledata):
+        """
+        Queues a tileset texture for decoding into slot idx, replacing
+        whatever was queued for that slot
+        """
+        TilesetCompletelyCached[name] = False
+        with self.condition:
+            self.generations[idx] += 1
+            self.jobs[idx] = [name, comptiledata, self.generations[idx], self.previews, False]
+            self.condition.notify()
 
-    def __init__(self):
-        super(StoppableThread, self).__init__()
-        self._stop_event = threading.Event()
-
-    def stop(self):
-        self._stop_event.set()
-
-    def stopped(self):
-        return self._stop_event.isSet()
+    def cancel(self, idx):
+        """
+        Drops the queued or running decode for slot idx
+        """
+        with self.condition:
+            self.generations[idx] += 1
+            self.jobs.pop(idx, None)
 
+    def pending(self):
+        with self.condition:
+            return bool(self.jobs)
 
-class ProgressiveTilesetRenderingThread(StoppableThread):
-    """
-    Thread that renders tilesets progressively.
-    It's a StoppableThread which allows the operation
-    to be killed (say, when the user opens a new level
-    before the current level's tilesets are finished
-    rendering).
-    """
-    @staticmethod
-    def getTileFromImage(tilemap, xtilenum, ytilenum):
-        return tilemap.copy((xtilenum * 64) + 2, (ytilenum * 64) + 2, 60, 60)
+    def setVisibleCounts(self, counts):
+        """
+        Sets how many objects from each slot are visible, which decides
+        the order the queued tilesets are decoded in
+        """
+        with self.condition:
+            self.visibleCounts = list(counts)
 
-    def setStuff(self, comptiledata, tilesetIdx, tileoffset, name):
+    def nextJob(self):
         """
-        Sets settings that the thread will use
+        Waits for a job and returns (slot, job, is preview). Previews go
+        before full decodes, and then more visible tilesets first.
         """
-        self.comptiledata = comptiledata
-        self.tilesetIdx = tilesetIdx
-        self.tileoffset = tileoffset
-        self.tilesetname = name
-        self.name = name # thread name
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+            idx = min(self.jobs, key=lambda idx: (not self.jobs[idx][3], -self.visibleCounts[idx], idx))
+            job = self.jobs[idx]
+            preview = job[3]
+            if preview:
+                job[3] = False
+            else:
+                del self.jobs[idx]
+            return idx, list(job), preview
 
     def run(self):
         """
-        Renders tilesets progressively.
+        Hands queued tilesets to the workers until the program exits
+        """
+        while True:
+            idx, (name, comptiledata, generation, previewPending, inThread), preview = self.nextJob()
+            mipLevel = 1 if preview else 0
+
+            inThread = inThread or self.executor is None
+            try:
+                gtxObj = gtx.loadGTX(comptiledata)
+                if preview and gtxObj.numMips < 2: continue
+                width = max(gtxObj.width >> mipLevel, 1)
+                height = max(gtxObj.height >> mipLevel, 1)
+
+                if inThread:
+                    pixels = gtx.decodeGTX(gtxObj, mipLevel)
+            except Exception as e:
+                print('Could not decode tileset %s: %s' % (name, e))
+                continue
+
+            if inThread:
+                self.decoded.emit(idx, name, generation, pixels, width, height, preview)
+                continue
+
+            # The pool can break while we wait for a worker, so check
+            # it again once we have one
+            self.workers.acquire()
+            executor = self.executor
+            block = None
+            try:
+                if executor is None:
+                    raise BrokenProcessPool('The process pool is gone')
+                if gtx.shared_memory is not None:
+                    block = gtx.shared_memory.SharedMemory(create=True, size=width * height * 4)
+                    future = executor.submit(gtx.decodeGTXInto, comptiledata, block.name, mipLevel)
+                else:
+                    future = executor.submit(gtx.decodeGTXData, comptiledata, mipLevel)
+            except Exception as e:
+                # Carry on without the pool, and retry this one
+                print('Could not use the process pool for tileset %s: %s' % (name, e))
+                self.workers.release()
+                if block is not None:
+                    block.close()
+                    block.unlink()
+                self.executor = None
+                if executor is not None:
+                    executor.shutdown(wait=False)
+                self.requeue(idx, name, comptiledata, generation, preview)
+                continue
+
+            future.add_done_callback(functools.partial(
+                self.finished, idx, name, comptiledata, generation, width, height, preview, block))
+
+    def requeue(self, idx, name, comptiledata, generation, preview, inThread=False):
+        """
+        Puts a job that couldn't be run back in the queue, unless its
+        slot has been given something else since. If inThread is True,
+        it's decoded on the scheduler thread rather than by a worker.
         """
-        TilesetCompletelyCached[self.tilesetname] = False
+        with self.condition:
+            if generation == self.generations[idx] and idx not in self.jobs:
+                self.jobs[idx] = [name, comptiledata, generation, preview, inThread]
+                self.condition.notify()
 
-        for image in gtx.renderGTX(gtx.loadGTX(self.comptiledata)):
+    def finished(self, idx, name, comptiledata, generation, width, height, preview, block, future):
+        """
+        Called when a worker is done with a tileset
+        """
+        self.workers.release()
+        pixels = None
+        try:
+            result = future.result()
+            if generation == self.generations[idx]:
+                pixels = result[0] if block is None else bytes(block.buf[:width * height * 4])
+        except BrokenProcessPool:
+            # Carry on without the pool, and retry this one
+            self.executor = None
+            self.requeue(idx, name, comptiledata, generation, preview)
+        except Exception as e:
+            # Errors sending the job to the worker (such as pickling
+            # errors) look the same as errors decoding it, so retry it on
+            # the scheduler thread; if it fails there too, it's dropped
+            print('Could not decode tileset %s in a worker, retrying: %s' % (name, e))
+            self.requeue(idx, name, comptiledata, generation, preview, True)
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+
+        if pixels is not None:
+            self.decoded.emit(idx, name, generation, pixels, width, height, preview)
+
+    @QtCore.pyqtSlot(int, str, int, object, int, int, bool)
+    def handleDecoded(self, idx, name, generation, pixels, width, height, preview):
+        """
+        Puts a decoded tileset into Tiles. Runs on the GUI thread.
+        """
+        if generation != self.generations[idx]: return # replaced or unloaded since
 
-            if self.stopped(): return
+        SetTilesetPixels(idx, name, pixels, width, height, preview)
+        if not preview: SaveTilesetToDiskCache(idx, pixels, width, height)
 
-            pix = QtGui.QPixmap.fromImage(image)
+
+def SetTilesetPixels(idx, name, pixels, width, height, preview=False, refresh=True):
+    """
+    Makes a decoded tileset texture (B, G, R, A pixels) the atlas of the
+    tiles of slot idx. A preview is half-size and is scaled up. If refresh is
+    True, the level view and object picker are updated.
+    """
+    image = gtx.imageFromPixels(pixels, width, height)
+    if preview:
+        image = image.scaled(width * 2, height * 2)
+    atlas = QtGui.QPixmap.fromImage(image)
+    TilesetAtlases[idx] = atlas
+
+    # Every tile points into the one atlas pixmap
+    tileoffset = idx * 256
+    sourcex = 0
+    sourcey = 0
+    for i in range(tileoffset, tileoffset + 256):
+        if Tiles[i] is not None:
+            Tiles[i].setAtlas(atlas, QtCore.QRect((sourcex * 64) + 2, (sourcey * 64) + 2, 60, 60))
+        sourcex += 1
+        if sourcex >= 32:
             sourcex = 0
-            sourcey = 0
-            for i in range(self.tileoffset, self.tileoffset + 256):
-                if Tiles[i] is not None:
-                    Tiles[i].setMain(self.getTileFromImage(pix, sourcex, sourcey))
-                sourcex += 1
-                if sourcex >= 32:
-                    sourcex = 0
-                    sourcey += 1
+            sourcey += 1
+
+    if not preview:
+        ProcessOverrides(idx, name)
+        TilesetCompletelyCached[name] = True
+
+    if refresh:
+        mainWindow.scene.update()
+        mainWindow.objPicker.LoadFromTilesets()
 
-            mainWindow.scene.update()
-            mainWindow.objPicker.LoadFromTilesets()
 
-            if self.stopped(): return
+def SaveTilesetToDiskCache(idx, pixels, width, height):
+    """
+    Stores a decoded tileset and its object definitions in the disk
+    cache, under the key of the archive it was loaded from
+    """
+    key = TilesetDiskCacheKeys[idx]
+    if TilesetDiskCache is None or key is None: return
 
-        ProcessOverrides(self.tilesetIdx, self.tilesetname)
+    objects = []
+    for obj in ObjectDefinitions[idx] or ():
+        objects.append(None if obj is None else [obj.width, obj.height, obj.rows])
+    TilesetDiskCache.put(key, pixels, width, height, objects)
+    TilesetDiskCacheKeys[idx] = None
 
-        TilesetCompletelyCached[self.tilesetname] = True
 
 class TilesetTile():
     """
-    Class that represents a single tile in a tileset
+    Class that represents a single tile in a tileset. Its image is either
+    its own pixmap (main), or a rect of its tileset's atlas pixmap, which
+    holds the whole tileset texture; main takes precedence.
     """
     def __init__(self, main):
         """
         Initializes the TilesetTile
         """
         self.main = main
+        self.atlas = None
+        self.sourceRect = None
         self.isAnimated = False
         self.animFrame = 0
         self.animTiles = []
         self.collData = ()
         self.collOverlay = None
         self.depthMap = None
+        self.composited = {} # (animation frame, collisions shown, depth shown) -> pixmap
+        self.compositedMain = None
 
     def setMain(self, main):
         """
         Sets self.main
         """
         self.main = main
+        self.clearCompositedTiles()
+
+    def setAtlas(self, atlas, sourceRect):
+        """
+        Makes the tile use sourceRect of the atlas pixmap as its image
+        """
+        self.main = None
+        self.atlas = atlas
+        self.sourceRect = QtCore.QRectF(sourceRect)
+        self.clearCompositedTiles()
+
+    def getMain(self):
+        """
+        Returns the tile's image as a pixmap of its own. For atlas tiles,
+        this is a new copy every time; use getMainSource() for drawing.
+        """
+        if self.main is not None or self.atlas is None: return self.main
+        return self.atlas.copy(self.sourceRect.toRect())
+
+    def getMainSource(self):
+        """
+        Returns (pixmap, source rect) for drawing the tile's image
+        """
+        if self.main is not None or self.atlas is None:
+            return self.main, None
+        return self.atlas, self.sourceRect
+
+    def drawMain(self, painter, x, y):
+        """
+        Draws the tile's image (without animations or overlays) at (x, y)
+        """
+        pix, source = self.getMainSource()
+        if pix is None: return
+        if source is not None:
+            painter.drawPixmap(QtCore.QPointF(x, y), pix, source)
+        elif isinstance(pix, QtGui.QImage):
+            painter.drawImage(x, y, pix)
+        else:
+            painter.drawPixmap(x, y, pix)
+
+    def clearCompositedTiles(self):
+        """
+        Forgets the cached tiles with overlays painted on, after the tile
+        or its overlays change
+        """
+        self.composited = {}
+        self.compositedMain = self.main
 
     def addAnimationData(self, data):
         """
@@ -158,6 +403,7 @@ class TilesetTile():
             animTiles.append(pix)
         self.animTiles = animTiles
         self.isAnimated = True
+        self.clearCompositedTiles()
 
     def nextFrame(self):
         """
@@ -178,19 +424,47 @@ class TilesetTile():
         """
         Returns the current tile based on the current animation frame
         """
-        result = None
-        if (not TilesetsAnimating) or (not self.isAnimated): result = self.main
-        else: result = self.animTiles[self.animFrame]
-        result = QtGui.QPixmap(result)
+        pix, source = self.getCurrentSource()
+        if source is not None: return pix.copy(source.toRect())
+        return pix
 
+    def getCurrentSource(self):
+        """
+        Returns (pixmap, source rect or None) for drawing the current
+        tile, based on the current animation frame and overlays. Tiles
+        without overlays are drawn straight from their atlas.
+        """
+        if (not TilesetsAnimating) or (not self.isAnimated):
+            frame = -1
+            result, source = self.getMainSource()
+        else:
+            frame = self.animFrame
+            result, source = self.animTiles[frame], None
+
+        showCollisions = CollisionsShown and (self.collOverlay is not None)
+        showDepth = DepthShown and (self.depthMap is not None)
+        if not (showCollisions or showDepth): return result, source
+
+        # Overlays are painted onto a copy, which is kept until something
+        # changes. (ProcessOverrides assigns main directly, so check that
+        # too.)
+        if self.compositedMain is not self.main: self.clearCompositedTiles()
+        key = (frame, showCollisions, showDepth)
+        if key in self.composited: return self.composited[key], None
+
+        if source is not None:
+            result = result.copy(source.toRect())
+        else:
+            result = QtGui.QPixmap(result)
         p = QtGui.QPainter(result)
-        if CollisionsShown and (self.collOverlay is not None):
+        if showCollisions:
             p.drawPixmap(0, 0, self.collOverlay)
-        if DepthShown and (self.depthMap is not None):
+        if showDepth:
             p.drawPixmap(0, 0, self.depthMap)
         del p
 
-        return result
+        self.composited[key] = result
+        return result, None
 
     def setCollisions(self, colldata):
         """
@@ -581,6 +855,7 @@ class TilesetTile():
             pass
 
         self.collOverlay = collPix
+        self.clearCompositedTiles()
 
 
     def addOverlay(self, overlayTile):
@@ -588,7 +863,8 @@ class TilesetTile():
         Adds a 3D overlay tile
         """
         if overlayTile is not None:
-            overlayPix = overlayTile.main
+            overlayPix = overlayTile.getMain()
+            if self.main is None: self.main = self.getMain() # painted on below
 
             # Create a depth map
             self.depthMap = QtGui.QPixmap(TileWidth, TileWidth)
@@ -606,8 +882,41 @@ class TilesetTile():
             p1.drawPixmap(0, 0, overlayPix)
             p1.end; del p1
 
+            self.clearCompositedTiles()
+
 
 def RenderObject(tileset, objnum, width, height, fullslope=False):
+    """
+    Render a tileset object into an array. The result is shared with
+    every other object with the same tileset, type and size, so it's a
+    tuple of tuples, which can't be changed.
+    """
+    key = (tileset, objnum, width, height, fullslope)
+    dest = RenderedObjects.get(key)
+    if dest is not None:
+        RenderedObjects.move_to_end(key)
+        return dest
+
+    dest = tuple(tuple(row) for row in _RenderObject(tileset, objnum, width, height, fullslope))
+    RenderedObjects[key] = dest
+    if len(RenderedObjects) > RenderedObjectsLimit:
+        RenderedObjects.popitem(last=False)
+    return dest
+
+
+def ForgetRenderedObjects(idx=None):
+    """
+    Forgets the rendered objects from tileset slot idx (or from every
+    slot), after its object definitions or tiles change
+    """
+    if idx is None:
+        RenderedObjects.clear()
+        return
+    for key in [key for key in RenderedObjects if key[0] == idx]:
+        del RenderedObjects[key]
+
+
+def _RenderObject(tileset, objnum, width, height, fullslope=False):
     """
     Render a tileset object into an array
     """
@@ -902,17 +1211,48 @@ def CreateTilesets():
     """
     Blank out the tileset arrays
     """
-    global Tiles, TilesetFilesLoaded, TilesetAnimTimer, TileBehaviours, ObjectDefinitions
+    global Tiles, TilesetFilesLoaded, TilesetAnimTimer, TileBehaviours, ObjectDefinitions, DecodeScheduler, TilesetDiskCache
 
     Tiles = [None]*0x200*4
     Tiles += Overrides
     TilesetFilesLoaded = [None, None, None, None]
+    TilesetAtlases[:] = [None, None, None, None]
     #TileBehaviours = [0]*1024
     TilesetAnimTimer = QtCore.QTimer()
     TilesetAnimTimer.timeout.connect(IncrementTilesetFrame)
     TilesetAnimTimer.start(180)
     ObjectDefinitions = [None]*4
     SLib.Tiles = Tiles
+    ForgetRenderedObjects()
+
+    if DecodeScheduler is None:
+        DecodeScheduler = TilesetDecodeScheduler()
+    for idx in range(4):
+        DecodeScheduler.cancel(idx)
+
+    if TilesetDiskCache is None:
+        path = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation)
+        if path:
+            try:
+                TilesetDiskCache = tilecache.TilesetDiskCache(os.path.join(path, 'tilesets'))
+            except OSError:
+                pass
+
+
+def PrioritizeVisibleTilesets():
+    """
+    Lets the decode scheduler know which tilesets are used by the
+    objects in the visible part of the level, so those are decoded first
+    """
+    if DecodeScheduler is None or not DecodeScheduler.pending(): return
+
+    view = mainWindow.view
+    rect = view.mapToScene(view.viewport().rect()).boundingRect()
+    counts = [0, 0, 0, 0]
+    for item in mainWindow.scene.items(rect):
+        idx = getattr(item, 'tileset', None) # only ObjectItems have this
+        if idx in (0, 1, 2, 3): counts[idx] += 1
+    DecodeScheduler.setVisibleCounts(counts)
 
 
 def LoadTileset(idx, name, reload=False):
@@ -961,34 +1301,83 @@ def _LoadTileset(idx, name, reload=False):
     # if compressed:
     #     arcdata = LHTool.decompressLH(arcdata)
     if name not in szsData: return
-    arcdata = szsData[name]
-    arc = SarcLib.SARC_Archive()
-    arc.load(arcdata)
+
+    # Decoded tilesets are kept on disk, by the hash of their archive. If
+    # this one has been seen before, the archive doesn't even have to be
+    # decompressed.
+    cacheKey = None
+    cached = None
+    TilesetDiskCacheKeys[idx] = None
+    if TilesetDiskCache is not None:
+        cacheKey = tilecache.archiveKey(szsData[name])
+        cached = TilesetDiskCache.get(cacheKey)
+
+    arc = None
+    if cached is None:
+        arcdata = compression.decompress(szsData[name])
+        arc = SarcLib.SARC_Archive()
+        arc.load(arcdata, lazy=True)
 
     tileoffset = idx * 256
 
-    global Tiles, TilesetCache, TileThreads
+    # Load the object definitions. This comes first, since putting in the
+    # texture from the disk cache processes the overrides, which use them.
+    defs = [None] * 256
+
+    if cached is not None:
+        # Already compiled, in the disk cache
+        for i, objdata in enumerate(cached[3]):
+            if objdata is None: continue
+            obj = ObjectDef()
+            obj.width, obj.height, obj.rows = objdata
+            defs[i] = obj
+    else:
+        indexfile = arc['BG_unt/%s_hd.bin' % name].data
+        deffile = arc['BG_unt/%s.bin' % name].data
+        objcount = len(indexfile) // 6
+        indexstruct = struct.Struct('>HBBH')
+
+        for i in range(objcount):
+            data = indexstruct.unpack_from(indexfile, i * 6)
+            obj = ObjectDef()
+            obj.width = data[1]
+            obj.height = data[2]
+            obj.load(deffile, data[0], tileoffset)
+            defs[i] = obj
+
+    ObjectDefinitions[idx] = defs
+    ForgetRenderedObjects(idx)
+
+    global Tiles, TilesetCache
     if name not in TilesetCache or not TilesetCompletelyCached[name]:
         # Load the tiles because they're not cached.
 
         # Decompress the textures
-        try:
-            comptiledata = arc['BG_tex/%s.gtx' % name].data
-            colldata = arc['BG_chk/d_bgchk_%s.bin' % name].data
-        except KeyError:
-            QtWidgets.QMessageBox.warning(None, trans.string('Err_CorruptedTilesetData', 0), trans.string('Err_CorruptedTilesetData', 1, '[file]', name))
-            return False
+        if cached is None:
+            try:
+                # A copy of its own, since it's sent to worker processes
+                # and memoryviews into the archive can't be pickled
+                comptiledata = arc['BG_tex/%s.gtx' % name].materialize()
+                colldata = arc['BG_chk/d_bgchk_%s.bin' % name].data
+            except KeyError:
+                QtWidgets.QMessageBox.warning(None, trans.string('Err_CorruptedTilesetData', 0), trans.string('Err_CorruptedTilesetData', 1, '[file]', name))
+                return False
 
         # Prepare the TilesetTiles
         for i in range(tileoffset, tileoffset + 256):
             Tiles[i] = TilesetTile(QtGui.QPixmap())
 
-        # Run the progressive tileset rendering thread for this tileset
-        if TileThreads[idx] is not None:
-            TileThreads[idx].stop()
-        TileThreads[idx] = ProgressiveTilesetRenderingThread()
-        TileThreads[idx].setStuff(comptiledata, idx, tileoffset, name)
-        TileThreads[idx].start()
+        if cached is not None:
+            # Use the texture from the disk cache
+            DecodeScheduler.cancel(idx)
+            pixels, width, height, objects = cached
+            SetTilesetPixels(idx, name, pixels, width, height, refresh=False)
+        else:
+            # Queue the texture for decoding; the tiles are filled in
+            # when it's done, and it's saved to the disk cache
+            TilesetDiskCacheKeys[idx] = cacheKey
+            DecodeScheduler.schedule(idx, name, comptiledata)
+            PrioritizeVisibleTilesets()
 
         # # Add overlays
         # overlayfile = arc['BG_unt/%s_add.bin' % name].data
@@ -1034,26 +1423,9 @@ def _LoadTileset(idx, name, reload=False):
         # We already have tiles in the tileset cache; copy them over to Tiles
         for i in range(256):
             Tiles[i + tileoffset] = TilesetCache[name][i]
+        TilesetAtlases[idx] = Tiles[tileoffset].atlas
 
 
-    # Load the object definitions
-    defs = [None] * 256
-
-    indexfile = arc['BG_unt/%s_hd.bin' % name].data
-    deffile = arc['BG_unt/%s.bin' % name].data
-    objcount = len(indexfile) // 6
-    indexstruct = struct.Struct('>HBBH')
-
-    for i in range(objcount):
-        data = indexstruct.unpack_from(indexfile, i * 6)
-        obj = ObjectDef()
-        obj.width = data[1]
-        obj.height = data[2]
-        obj.load(deffile, data[0], tileoffset)
-        defs[i] = obj
-
-    ObjectDefinitions[idx] = defs
-
     # Keep track of this filepath
     TilesetFilesLoaded[idx] = name
 
@@ -1148,15 +1520,20 @@ def UnloadTileset(idx):
     """
     for i in range(idx * 0x200, idx * 0x200 + 0x200):
         Tiles[i] = None
+    TilesetAtlases[idx] = None
+
+    if DecodeScheduler is not None: DecodeScheduler.cancel(idx)
 
     ObjectDefinitions[idx] = None
     TilesetFilesLoaded[idx] = None
+    ForgetRenderedObjects(idx)
 
 
 def ProcessOverrides(idx, name):
     """
     Load overridden tiles if there are any
     """
+    ForgetRenderedObjects(idx)
 
     try:
         tsindexes = ['J_Kihon', 'J_Chika', 'J_Setsugen', 'J_Yougan', 'J_Gold', 'J_Suichu']
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Reggie! - New Super Mario Bros. U Level Editor
+# Version Next Milestone 2 Alpha 4
+# Copyright (C) 2009-2015 Treeki, Tempus, angelsl, JasonP27, Kamek64,
+# MalStar1000, RoadrunnerWMC, MrRean
+
+# This file is part of Reggie!.
+
+# Reggie! is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Reggie! is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Reggie!.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# tilecache.py
+# An on-disk cache of decoded tilesets, so that tileset textures don't
+# have to be decoded again every time a level is opened. Entries are
+# keyed by the hash of the tileset archive.
+
+
+################################################################
+################################################################
+
+# Imports
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+
+def archiveKey(data):
+    """
+    Returns the cache key for a tileset archive's data
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+class TilesetDiskCache():
+    """
+    A folder of decoded tilesets. Each entry is one file, with a header,
+    the decoded texture as raw B, G, R, A pixels (at a page-aligned
+    offset, so the file can be mapped straight into memory) and the
+    compiled object definitions. Entries are checked when read, and the
+    least recently used ones are deleted when the folder gets bigger
+    than the size budget.
+    """
+    Magic = b'RTSC'
+    Version = 1 # bump this if the decoded data changes
+    Extension = '.tsc'
+
+    # magic, version, width, height, object definitions length, CRC32
+    HeaderStruct = struct.Struct('<4s5I')
+    DataOffset = 0x1000
+
+    def __init__(self, path, budget=0x10000000):
+        self.path = path
+        self.budget = budget
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, key + self.Extension)
+
+    def get(self, key):
+        """
+        Returns (pixels, width, height, objects) for a key, or None if
+        there's no valid entry for it. objects is what was given to
+        put().
+        """
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    entry = self._read(data)
+        except (IOError, ValueError):
+            entry = None
+
+        if entry is None:
+            # Missing, or broken, in which case it's no use keeping it
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return None
+
+        # Mark it as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return entry
+
+    def _read(self, data):
+        if len(data) < self.DataOffset: return None
+        magic, version, width, height, objectsLength, crc = self.HeaderStruct.unpack_from(data, 0)
+        if magic != self.Magic or version != self.Version: return None
+
+        pixelsEnd = self.DataOffset + width * height * 4
+        if len(data) != pixelsEnd + objectsLength: return None
+        if zlib.crc32(memoryview(data)[self.DataOffset:]) != crc: return None
+
+        pixels = data[self.DataOffset:pixelsEnd]
+        objects = json.loads(data[pixelsEnd:].decode('utf-8'))
+        return pixels, width, height, objects
+
+    def put(self, key, pixels, width, height, objects):
+        """
+        Stores a decoded tileset. objects has to be JSON-serializable.
+        """
+        objectsData = json.dumps(objects, separators=(',', ':')).encode('utf-8')
+        crc = zlib.crc32(objectsData, zlib.crc32(pixels))
+        header = self.HeaderStruct.pack(self.Magic, self.Version, width, height, len(objectsData), crc)
+
+        # Write it under a temporary name first, so a half-written entry
+        # is never picked up
+        filename = self.filename(key)
+        tempname = filename + '.%d.tmp' % os.getpid()
+        try:
+            with open(tempname, 'wb') as f:
+                f.writelines((header, bytes(self.DataOffset - len(header)), pixels, objectsData))
+            os.replace(tempname, filename)
+        except OSError:
+            try:
+                os.remove(tempname)
+            except OSError:
+                pass
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in
+        its size budget
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.Extension): continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.budget: break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """
+        Deletes every entry
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(self.Extension):
+                os.remove(os.path.join(self.path, name))
@@ -39,6 +39,10 @@ import re
 import struct
 import time # temp
 
+# Level used when none is given. Higher levels get slow quickly (level 9
+# is about eight times slower on a large level archive) for output that
+# is only 10-20% smaller, so they have to be asked for explicitly.
+DEFAULT_LEVEL = 3
 
 
 class yaz0():
@@ -200,12 +204,7 @@ class yaz0():
         return output
 
 
-    # To do:
-    # 1) Optimization
-    # 2) Better compression
-    # 3) Testing under real conditions
-    #    (e.g. replace a file in a game with a file compressed with this method)
-    def compress(self, compressLevel = 0, advanced = False):
+    def compress(self, compressLevel = DEFAULT_LEVEL, advanced = True):
         if not self.compressFlag:
             raise RuntimeError('Trying to compress, but compress flag is not set.'
                                'Create yaz0 object with compress = True as one of its arguments.')
@@ -213,142 +212,288 @@ class yaz0():
         if compressLevel >= 10 or compressLevel < 0:
             raise RuntimeError('CompressionLevel is limited to 0-9.')
 
-        fileobj = self.fileobj
-        output = self.output
-        maxsize = self.maxsize
-
-        # compressLevel can be one of the values from 0 to 9.
-        # It will reduce the area in which the method will look
-        # for matches and speed up compression slightly.
-        compressRatio = 0.1 * (compressLevel + 1)
-        maxSearch = 2**12 - 1
-        adjustedSearch = int(maxSearch  *compressRatio)
-        adjustedMaxBytes = int(math.ceil(15 * compressRatio + 2))
-
-        # The advanced flag will allow the use of a third byte,
-        # enabling the method to look for matches that are up to
-        # 256 bytes long. NOT IMPLEMENTED YET
-
-        print(time.time())
-        if advanced == False:
-            while fileobj.tell() < maxsize:
-
-                buffer = bytearray()
-                codeByte = 0
-
-                for i in range(8):
-                    # 15 bytes can be stored in a nybble. The decompressor will
-                    # read 15 + 2 bytes, possibly to account for the way compression works.
-                    maxBytes = adjustedMaxBytes
-
-                    # Store the current file pointer for reference.
-                    currentPos = fileobj.tell()
-
-                    # Adjust maxBytes if we are close to the end.
-                    if maxsize - currentPos < maxBytes:
-                        maxBytes = maxsize - currentPos
-                        print('Maxbytes adjusted to', maxBytes)
-
-                    # Calculate the starting position for the search
-                    searchPos = currentPos - adjustedSearch
-
-                    # Should the starting position be negative, it will be set to 0.
-                    # We will also adjust how much we need to read.
-                    if searchPos < 0:
-                        searchPos = 0
-                        realSearch = currentPos
-                    else:
-                        realSearch = adjustedSearch
-
-                    # toSearch will be the bytes (up to 2**12 long) in which
-                    # we will search for matches of the pattern.
-                    pattern = fileobj.read(maxBytes)
-                    fileobj.seek(searchPos)
-                    toSearch = fileobj.read(realSearch)
-                    fileobj.seek(currentPos + len(pattern))
-
-                    index = toSearch.rfind(pattern)
-
-                    # If a match hasn't been found, we will start a loop in which we
-                    # will steadily reduce the length of the pattern, increasing the chance
-                    # of finding a matching string. The pattern needs to be at least 3 bytes
-                    # long, otherwise there is no point in trying to compress it.
-                    # (The algorithm uses at least 2 bytes to represent such patterns)
-                    while index == -1 and maxBytes > 3:
-                        fileobj.seek(currentPos)
-
-                        maxBytes -= 1
-                        pattern = fileobj.read(maxBytes)
-
-                        if len(pattern) < maxBytes:
-                            maxBytes = len(pattern)
-                            print('adjusted pattern length')
-
-                        index = toSearch.rfind(pattern)
-
-                    if index == -1 or maxBytes <= 2:
-                        # No match found. Read a byte and append it to the buffer directly.
-                        fileobj.seek(currentPos)
-                        byte = fileobj.read(1)
-
-                        # At the end of the file, read() will return an empty string.
-                        # In that case we will set the byte to the 0 character.
-                        # Hopefully, a decompressor will check the uncompressed size
-                        # of the file and remove any padding bytes past this position.
-                        if len(byte) == 0:
-                            byte = 0
-                        else:
-                            byte = byte[0]
+        # The whole input is compressed in memory; the header
+        # was already written by __init__.
+        self.fileobj.seek(0)
+        data = self.fileobj.read()
+        self.output.write(compress_data(data, compressLevel, advanced))
+
+        return self.output
 
-                        buffer.append(byte)
+    # A simple iterator for iterating over the bits of a single byte
+    def __bit_iter__(self, byte):
+        for i in range(8):
+            result = (byte << i) & 0x80
+            yield result != 0
 
-                        # Mark the bit in the codebyte as 1.
-                        codeByte = (1 << (7-i)) | codeByte
 
-                    else:
-                        # A match has been found, we need to calculate its index relative to
-                        # the current position. (RealSearch stores the total size of the search string,
-                        # while the index variable holds the position of the pattern in the search string)
-                        relativeIndex = realSearch - index
-
-                        # Create the two descriptor bytes which hold the length of the pattern and
-                        # its index relative to the current position.
-                        # Marking the bit in the codebyte as 0 isn't necessary, it will be 0 by default.
-                        byte1, byte2 = self.__build_byte__(maxBytes - 2, relativeIndex - 1)
-
-                        buffer.append(byte1)
-                        buffer.append(byte2)
-
-                # Now that everything is done, we will append the code byte and
-                # our compressed data from the buffer to the output.
-                output.write(bytes(codeByte))
-                output.write(buffer)
+
+#
+#    Hash-chain compressor.
+#
+
+# Yaz0 back-references can reach 0x1000 bytes back and copy
+# up to 0x11 bytes (two-byte code) or 0x111 bytes (three-byte code).
+WINDOW_SIZE = 0x1000
+MAX_MATCH_SHORT = 0x11
+MAX_MATCH_LONG = 0x111
+MIN_MATCH = 3
+
+# Search parameters for each compression level:
+# (max hash chain length, lazy matching, nice match length, max insert length)
+# Once a match reaches the "nice" length, the search stops early.
+# Positions inside matches longer than "max insert length" are not
+# added to the hash chains, which is faster but finds fewer matches.
+_levelSettings = (
+    (1,    False, 8,     8),
+    (2,    False, 16,    16),
+    (4,    False, 32,    32),
+    (8,    True,  32,    MAX_MATCH_LONG),
+    (16,   True,  64,    MAX_MATCH_LONG),
+    (32,   True,  128,   MAX_MATCH_LONG),
+    (64,   True,  MAX_MATCH_LONG, MAX_MATCH_LONG),
+    (128,  True,  MAX_MATCH_LONG, MAX_MATCH_LONG),
+    (512,  True,  MAX_MATCH_LONG, MAX_MATCH_LONG),
+    (4096, True,  MAX_MATCH_LONG, MAX_MATCH_LONG),
+    )
+
+
+def compress_data(data, compressLevel=DEFAULT_LEVEL, advanced=True):
+    """
+    Compresses a bytes-like object and returns the Yaz0 code stream
+    (everything after the 16-byte header) as a bytearray.
+
+    Matches are found with hash chains over the 0x1000-byte window.
+    At levels 3 and up, a match is deferred by one byte if the next
+    position has a match that is at least 2 bytes longer, just like
+    Nintendo's own encoder does. If advanced is True, three-byte codes
+    are used for matches of 0x12 to 0x111 bytes.
+    """
+    return _encode(data, compressLevel, advanced)[0]
+
+
+def _encode(data, compressLevel, advanced, start=0, end=None):
+    """
+    Compresses data[start:end] into a Yaz0 code stream. The bytes before
+    start are only used to prime the window, so that the stream can be
+    appended to the one for the data before it.
+
+    Returns (stream, number of tokens, offset of the last code byte).
+    """
+    if compressLevel >= 10 or compressLevel < 0:
+        raise RuntimeError('CompressionLevel is limited to 0-9.')
+
+    maxChain, lazy, niceLength, maxInsert = _levelSettings[compressLevel]
+    maxMatch = MAX_MATCH_LONG if advanced else MAX_MATCH_SHORT
+    if niceLength > maxMatch: niceLength = maxMatch
+
+    data = bytes(data)
+    size = len(data) if end is None else end
+    lastKeyPos = len(data) - MIN_MATCH + 1
+
+    # head maps each 3-byte string to the latest position it was seen at;
+    # prev links each position to the previous one with the same 3 bytes.
+    # prev only has to cover the window, so it's used as a ring buffer.
+    head = {}
+    prev = [-1] * WINDOW_SIZE
+    mask = WINDOW_SIZE - 1
+
+    for p in range(max(start - WINDOW_SIZE, 0), min(start, lastKeyPos)):
+        key = data[p:p + MIN_MATCH]
+        prev[p & mask] = head.get(key, -1)
+        head[key] = p
+
+    def findMatch(pos):
+        """
+        Returns (length, distance) of the longest match at pos,
+        or (0, 0) if there is none
+        """
+        maxLen = size - pos
+        if maxLen > maxMatch: maxLen = maxMatch
+        if maxLen < MIN_MATCH: return 0, 0
+
+        bestLen = MIN_MATCH - 1
+        bestDist = 0
+        limit = pos - WINDOW_SIZE
+        cand = head.get(data[pos:pos + MIN_MATCH], -1)
+        chain = maxChain
+
+        while cand >= limit and cand >= 0 and chain:
+            # Quick reject: a longer match must at least agree
+            # at the byte just past the current best one
+            if data[cand + bestLen] == data[pos + bestLen]:
+                length = MIN_MATCH
+                while length + 16 <= maxLen and data[cand + length:cand + length + 16] == data[pos + length:pos + length + 16]:
+                    length += 16
+                while length < maxLen and data[cand + length] == data[pos + length]:
+                    length += 1
+
+                if length > bestLen:
+                    bestLen, bestDist = length, pos - cand
+                    if length >= niceLength or length >= maxLen: break
+
+            cand = prev[cand & mask]
+            chain -= 1
+
+        if bestDist: return bestLen, bestDist
+        return 0, 0
+
+    out = bytearray()
+    codePos = 0
+    bits = 0
+    tokens = 0
+    pos = start
+    inserted = start # every position below this is in the hash chains
+    pending = None
+
+    while pos < size:
+        if not bits:
+            codePos = len(out)
+            out.append(0)
+            bits = 8
+        bits -= 1
+        tokens += 1
+
+        if pending is not None:
+            length, dist = pending
+            pending = None
         else:
-            raise RuntimeError('Advanced compression not implemented yet.')
+            length, dist = findMatch(pos)
+
+        if lazy and MIN_MATCH <= length < niceLength and pos + 1 < lastKeyPos:
+            # Insert pos first, so the lookahead can match against it
+            key = data[pos:pos + MIN_MATCH]
+            prev[pos & mask] = head.get(key, -1)
+            head[key] = pos
+            inserted = pos + 1
+
+            nextLength, nextDist = findMatch(pos + 1)
+            if nextLength >= length + 2:
+                # Emit a literal, and use the better match next time
+                out[codePos] |= 1 << bits
+                out.append(data[pos])
+                pos += 1
+                pending = nextLength, nextDist
+                continue
+
+        if length:
+            dist -= 1
+            if length >= 0x12:
+                out += bytes((dist >> 8, dist & 0xFF, length - 0x12))
+            else:
+                out += bytes((((length - 2) << 4) | (dist >> 8), dist & 0xFF))
+            nextPos = pos + length
+        else:
+            out[codePos] |= 1 << bits
+            out.append(data[pos])
+            nextPos = pos + 1
 
-        print(time.time())
-        return output
+        # Add the covered positions to the hash chains
+        if length <= maxInsert:
+            insertEnd = nextPos if nextPos < lastKeyPos else lastKeyPos
+        else:
+            insertEnd = pos + 1 if pos + 1 < lastKeyPos else lastKeyPos
+        for p in range(inserted if inserted > pos else pos, insertEnd):
+            key = data[p:p + MIN_MATCH]
+            prev[p & mask] = head.get(key, -1)
+            head[key] = p
+        inserted = nextPos
 
-    def __build_byte__(self, byteCount, position):
-        if position >= 2**12:
-            raise RuntimeError('{0} is outside of the range for 12 bits!'.format(position))
-        if byteCount > 0xF:
-            raise RuntimeError('{0} is too much for 4 bits.'.format(byteCount))
+        pos = nextPos
 
-        positionNibble = position >> 8
-        positionByte = position & 0xFF
+    return out, tokens, codePos
 
-        byte1 = (byteCount << 4) | positionNibble
 
-        return byte1, positionByte
+#
+#    Parallel compression of large inputs.
+#
 
+def _compressSegment(job):
+    """
+    Process pool worker: compresses one segment
+    """
+    data, start, end, compressLevel, advanced = job
+    return _encode(data, compressLevel, advanced, start, end)
+
+
+def _iterTokens(stream, size):
+    """
+    Yields (isLiteral, payload) for each token of a code stream
+    that decompresses to size bytes
+    """
+    pos = 0
+    done = 0
+    while done < size:
+        code = stream[pos]
+        pos += 1
 
-    # A simple iterator for iterating over the bits of a single byte
-    def __bit_iter__(self, byte):
         for i in range(8):
-            result = (byte << i) & 0x80
-            yield result != 0
+            if done >= size: break
+
+            if code & 0x80:
+                yield True, stream[pos:pos + 1]
+                pos += 1
+                done += 1
+            else:
+                count = stream[pos] >> 4
+                if count:
+                    yield False, stream[pos:pos + 2]
+                    pos += 2
+                    done += count + 2
+                else:
+                    yield False, stream[pos:pos + 3]
+                    done += stream[pos + 2] + 0x12
+                    pos += 3
 
+            code <<= 1
+
+
+def compress_parallel(bytesObj, compressLevel=DEFAULT_LEVEL, advanced=True, segmentSize=0x40000, processes=None):
+    """
+    Compresses a large bytes-like object by splitting it into segments
+    and compressing them in a process pool. Each segment's window is
+    primed with the 0x1000 bytes before it, so only matches that would
+    cross a segment boundary are lost; smaller segments use more cores
+    at the cost of a little ratio. The result is one valid Yaz0 stream.
+    """
+    data = bytes(bytesObj)
+    size = len(data)
+    if size <= segmentSize:
+        return compress(data, compressLevel, advanced)
+
+    jobs = []
+    for start in range(0, size, segmentSize):
+        end = min(start + segmentSize, size)
+        windowStart = max(start - WINDOW_SIZE, 0)
+        jobs.append((data[windowStart:end], start - windowStart, end - windowStart, compressLevel, advanced))
+
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        results = list(executor.map(_compressSegment, jobs))
+
+    # Stitch the segments together. A segment can be appended as-is
+    # if the previous one filled its last code byte; otherwise its
+    # tokens have to be regrouped under new code bytes.
+    out = bytearray(b'Yaz0' + struct.pack('>I', size) + b'\x00' * 8)
+    codePos = 0
+    bits = 0
+    for job, (stream, tokens, lastCodePos) in zip(jobs, results):
+        if not bits:
+            codePos = len(out) + lastCodePos
+            out += stream
+            bits = -tokens % 8
+            continue
+
+        for isLiteral, payload in _iterTokens(stream, job[2] - job[1]):
+            if not bits:
+                codePos = len(out)
+                out.append(0)
+                bits = 8
+            bits -= 1
+            if isLiteral: out[codePos] |= 1 << bits
+            out += payload
+
+    return bytes(out)
 
 
 #
@@ -388,29 +533,31 @@ def decompress_file(filenamePath, outputPath=None):
 
     return result
 
-# Take an uncompressed bytes object, compress it and
-# return the results as a bytes object.
-def compress(bytesObj, compressLevel=9):
-    buffer = BytesIO(bytesObj)
-    yaz0obj = yaz0(buffer, compress=True)
-    return yaz0obj.compress(compressLevel).getvalue()
-print(compress)
+# Take an uncompressed bytes-like object, compress it and
+# return the results as a bytes object. This works directly
+# in memory, without going through a file-like object.
+def compress(bytesObj, compressLevel=DEFAULT_LEVEL, advanced=True):
+    header = b'Yaz0' + struct.pack('>I', len(bytesObj)) + b'\x00' * 8
+    return header + compress_data(bytesObj, compressLevel, advanced)
 
 # Take a file-like object, compress it and
 # return the results as a BytesIO object.
-def compress_fileobj(fileobj, compressLevel=9):
+def compress_fileobj(fileobj, compressLevel=DEFAULT_LEVEL):
     yaz0obj = yaz0(fileobj, compress=True)
     return yaz0obj.compress(compressLevel)
 
 # Take a file name and compress the contents of that file.
 # If outputPath is not None, write the results to a file
 # with the name defined by outputPath, otherwise return
-# results as a StringIO object.
-def compress_file(filenamePath, outputPath=None, compressLevel=9):
+# results as a StringIO object. If parallel is True, large
+# files are compressed in segments using a process pool.
+def compress_file(filenamePath, outputPath=None, compressLevel=DEFAULT_LEVEL, parallel=False):
     with open(filenamePath, 'rb') as fileobj:
-        yaz0obj = yaz0(fileobj, compress=True)
-
-        result = yaz0obj.compress(compressLevel)
+        if parallel:
+            result = BytesIO(compress_parallel(fileobj.read(), compressLevel))
+        else:
+            yaz0obj = yaz0(fileobj, compress=True)
+            result = yaz0obj.compress(compressLevel)
 
         if outputPath != None:
             with open(outputPath, 'wb') as output:
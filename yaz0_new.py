@@ -50,46 +50,237 @@
 
 
 import struct
+import sys
+import time
 
 
-def decompress(data):
-    uint16struct = struct.Struct('>H')
+# Number of leading 1 bits (literal flags) in each possible code byte
+_literalRuns = bytes(
+    next((i for i in range(8) if not (code << i) & 0x80), 8)
+    for code in range(256))
+
 
+def decompress(data):
     assert data[:4] == b'Yaz0'
 
     pos = 16
     decompsize = struct.unpack_from('>I', data, 4)[0]
     out = bytearray(decompsize)
     outpos = 0
-    bits = 0
 
     while outpos < decompsize: # Read entire file
-        if not bits:
-            code = data[pos]
-            pos += 1
-            bits = 8
-
-        if code & 0x80: # Copy 1 byte
-            out[outpos] = data[pos]
-            outpos += 1
-            pos += 1
-        else:
-            rle = uint16struct.unpack_from(data, pos)[0]
-            pos += 2
-
-            dist = rle & 0xFFF
-            dstpos = outpos - dist - 1
+        code = data[pos]
+        pos += 1
+        bits = 8
+
+        while bits and outpos < decompsize:
+            run = _literalRuns[code]
+            if run: # Copy a run of literal bytes at once
+                if run > decompsize - outpos:
+                    run = decompsize - outpos
+                out[outpos:outpos + run] = data[pos:pos + run]
+                outpos += run
+                pos += run
+                code = (code << run) & 0xFF
+                bits -= run
+                continue
+
+            rle = (data[pos] << 8) | data[pos + 1]
+            dist = (rle & 0xFFF) + 1
             read = rle >> 12
             if read:
                 read += 2
+                pos += 2
             else:
-                read = data[pos] + 0x12
-                pos += 1
+                read = data[pos + 2] + 0x12
+                pos += 3
 
-            for x in range(read):
-                out[outpos + x] = out[dstpos + x]
+            if read > decompsize - outpos:
+                read = decompsize - outpos
+            dstpos = outpos - dist
+
+            if dist >= read:
+                # Non-overlapping: one slice copy
+                out[outpos:outpos + read] = out[dstpos:dstpos + read]
+            else:
+                # Overlapping: the last dist bytes repeat, so build the
+                # run by repetition (CPython doubles the copy internally)
+                out[outpos:outpos + read] = (out[dstpos:outpos] * (read // dist + 1))[:read]
             outpos += read
 
-        code <<= 1
-        bits -= 1
-    return out
\ No newline at end of file
+            code = (code << 1) & 0xFF
+            bits -= 1
+
+    if len(out) != decompsize:
+        raise ValueError('Yaz0 data ended early')
+
+    return out
+
+class Yaz0StreamDecoder():
+    """
+    Incremental Yaz0 decoder. Compressed data can be fed to it in
+    chunks of any size; each call to feed() returns the decompressed
+    data that became available. Only the last 0x1000 bytes of output
+    are kept around, for back-references.
+
+    If limit is given, decoding stops after that many output bytes.
+    """
+    def __init__(self, limit=None):
+        self.decompressedSize = None
+        self.limit = limit
+        self.totalOut = 0
+        self.eof = False
+
+        self._end = 0
+        self._input = bytearray()
+        self._window = bytearray()
+        self._code = 0
+        self._bits = 0
+
+    def feed(self, data):
+        """
+        Decodes as much as possible of the data fed so far, and returns
+        the newly decompressed bytes
+        """
+        if self.eof: return b''
+        self._input += data
+
+        if self.decompressedSize is None:
+            if len(self._input) < 16: return b''
+            if self._input[:4] != b'Yaz0':
+                raise ValueError('Data is not Yaz0-compressed!')
+
+            self.decompressedSize = struct.unpack_from('>I', self._input, 4)[0]
+            self._end = self.decompressedSize
+            if self.limit is not None and self.limit < self._end:
+                self._end = self.limit
+            del self._input[:16]
+
+        return self._decode()
+
+    def _decode(self):
+        """
+        Runs the decoder until it runs out of input or reaches the end
+        """
+        src = self._input
+        srclen = len(src)
+        out = self._window
+        outStart = len(out)
+        end = self._end
+        total = self.totalOut
+        code = self._code
+        bits = self._bits
+        pos = 0
+
+        while total < end:
+            if not bits:
+                if pos >= srclen: break
+                code = src[pos]
+                pos += 1
+                bits = 8
+
+            if code & 0x80: # Copy 1 byte
+                if pos >= srclen: break
+                out.append(src[pos])
+                pos += 1
+                total += 1
+            else:
+                # Don't start a back-reference that isn't fully buffered
+                if pos + 1 >= srclen: break
+                rle = (src[pos] << 8) | src[pos + 1]
+                read = rle >> 12
+                if read:
+                    read += 2
+                    pos += 2
+                else:
+                    if pos + 2 >= srclen: break
+                    read = src[pos + 2] + 0x12
+                    pos += 3
+
+                dist = (rle & 0xFFF) + 1
+                dstpos = len(out) - dist
+                if dstpos < 0:
+                    raise ValueError('Invalid Yaz0 back-reference')
+
+                if dist >= read:
+                    out += out[dstpos:dstpos + read]
+                else:
+                    # Overlapping copy: the last dist bytes repeat
+                    out += (out[dstpos:] * (read // dist + 1))[:read]
+                total += read
+
+            code <<= 1
+            bits -= 1
+
+        del src[:pos]
+        self._code = code
+        self._bits = bits
+
+        # The last back-reference may go past the end
+        if total > end:
+            del out[end - total:]
+            total = end
+
+        result = bytes(out[outStart:])
+        del out[:-0x1000]
+
+        self.totalOut = total
+        if total >= end: self.eof = True
+
+        return result
+
+
+def iter_decompress(fileobj, chunkSize=0x10000):
+    """
+    Reads Yaz0 data from a file-like object in chunks, and yields the
+    decompressed data piece by piece as it becomes available
+    """
+    decoder = Yaz0StreamDecoder()
+    while not decoder.eof:
+        chunk = fileobj.read(chunkSize)
+        if not chunk:
+            raise ValueError('Yaz0 data ended early')
+
+        result = decoder.feed(chunk)
+        if result: yield result
+
+
+def decompress_prefix(data, size):
+    """
+    Decompresses only the first size bytes of some Yaz0 data
+    """
+    return Yaz0StreamDecoder(size).feed(data)
+
+
+def main():
+    """
+    Benchmarks the decoder on the files given on the command line.
+    Files that aren't Yaz0-compressed (tileset archives, for example)
+    are compressed first.
+    """
+    if len(sys.argv) < 2:
+        print('Usage: ' + sys.argv[0] + ' file.szs [file2.sarc ...]')
+        return
+
+    import yaz0
+
+    for filename in sys.argv[1:]:
+        with open(filename, 'rb') as fileobj:
+            data = fileobj.read()
+        if not data.startswith(b'Yaz0'):
+            data = yaz0.compress(data, 6)
+
+        decompsize = struct.unpack_from('>I', data, 4)[0]
+        runs = max(1, min(20, 0x1000000 // max(decompsize, 1)))
+
+        start = time.perf_counter()
+        for i in range(runs):
+            decompress(data)
+        elapsed = (time.perf_counter() - start) / runs
+
+        print('{0}: {1} -> {2} bytes, {3:.2f} ms, {4:.1f} MB/s'.format(
+            filename, len(data), decompsize, elapsed * 1000,
+            decompsize / elapsed / 0x100000 if elapsed else 0))
+
+
+if __name__ == '__main__': main()